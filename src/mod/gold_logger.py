@@ -2,8 +2,10 @@
 
 import re
 import BigWorld
+import game
 import nations
 import ResMgr
+from PlayerEvents import g_playerEvents
 from functools import wraps, partial
 from items import _xml
 from constants import ITEM_DEFS_PATH
@@ -11,10 +13,20 @@ from helpers.EffectsList import _PixieEffectDesc
 from helpers.bound_effects import ModelBoundEffects, StaticSceneBoundEffects
 
 import os
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 
 LOG_FILE = './GOLD_USER.csv'
+SHELL_PRICES_CACHE_FILE = './GOLD_LOGGER_PRICES.dat'
+PROFILE_LOG_FILE = './GOLD_LOGGER_PROFILE.log'
+PROFILE_HOOKS = False  # Set to True to log the latency of hooks at the end of each battle
+SHELL_EFFECT_PATTERN = re.compile('^particles/Shells_Eff/([a-zA-Z0-9_-]+)\.xml$')
 gold_users = set()
+effect_shell_types = {}
 
 
 def prepare_log_file():
@@ -22,17 +34,29 @@ def prepare_log_file():
         open(LOG_FILE, 'w').close()
 
     with open(LOG_FILE, 'r') as log_file:
-        for line in log_file.readline():
+        for line in log_file:
             player_data = line.rstrip().split(',')
             if len(player_data) > 1:
-                player_name, _ = player_data
+                player_name = player_data[0]
                 gold_users.add(player_name)
 
 
-def log_gold_user(player_name, account_id):
-    with open(LOG_FILE, 'a') as log_file:
-        log_file.write("%s,%s\n" % (player_name, account_id))
-    gold_users.add(player_name)
+class GoldUserLogWriter:
+    def __init__(self, log_file):
+        self._log_file = log_file
+        self._entries = []
+    def add(self, player_name, account_id, arena_id, shell_type):
+        if player_name in gold_users:
+            return
+        gold_users.add(player_name)
+        self._entries.append((player_name, account_id, arena_id, shell_type))
+    def flush(self, *args):
+        if not self._entries:
+            return
+        entries, self._entries = self._entries, []
+        with open(self._log_file, 'a') as log_file:
+            for entry in entries:
+                log_file.write("%s,%s,%s,%s\n" % entry)
 
 
 class ModifiedValueManager:
@@ -46,13 +70,47 @@ class ModifiedValueManager:
         self._values = []
 
 
+class HookProfiler:
+    def __init__(self, log_file):
+        self._log_file = log_file
+        self._timer = getattr(time, 'perf_counter', None) or time.clock  # High resolution on Windows
+        self._latencies = {}
+    def call(self, hook_name, callback, *args, **kwargs):
+        start = self._timer()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            self._latencies.setdefault(hook_name, []).append(self._timer() - start)
+    def dump(self, *args):
+        if not self._latencies:
+            return
+        latencies_d, self._latencies = self._latencies, {}
+        with open(self._log_file, 'a') as log_file:
+            log_file.write("Battle ended at %s\n" % time.strftime('%Y-%m-%d %H:%M:%S'))
+            for hook_name in sorted(latencies_d):
+                latencies = sorted(latencies_d[hook_name])
+                count = len(latencies)
+                percentile = lambda ratio: latencies[min(count - 1, int(ratio * count))] * 1e6
+                log_file.write("  %s: %d calls, total %.3f ms, mean %.1f us, p50 %.1f us, p95 %.1f us, p99 %.1f us, max %.1f us\n" % (
+                    hook_name, count, sum(latencies) * 1e3, sum(latencies) / count * 1e6,
+                    percentile(0.50), percentile(0.95), percentile(0.99), latencies[-1] * 1e6
+                ))
+
+
+hook_profiler = HookProfiler(PROFILE_LOG_FILE) if PROFILE_HOOKS else None
+
+
 def run_before(module, func_name):
     def decorator(callback):
         func = getattr(module, func_name)
+        hook_name = '%s.%s' % (getattr(module, '__name__', module), func_name)
 
         @wraps(func)
         def run_before_wrapper(*args, **kwargs):
-            callback(*args, **kwargs)
+            if hook_profiler is None:
+                callback(*args, **kwargs)
+            else:
+                hook_profiler.call(hook_name, callback, *args, **kwargs)
             return func(*args, **kwargs)
 
         setattr(module, func_name, run_before_wrapper)
@@ -70,11 +128,58 @@ def load_shell_prices(nation):
             continue
         xml_ctx = (None, xml_path + '/' + name)
         shell_id = _xml.readInt(xml_ctx, subsection, 'id', 0, 65535)
-        prices[shell_id] = _xml.readPrice(xml_ctx, subsection, 'price')
+        price = _xml.readPrice(xml_ctx, subsection, 'price')
+        prices[shell_id] = (price.get('gold', None), price.get('credits', 0))
     ResMgr.purge(xml_path, True)
     return prices
 
 
+def get_game_version():
+    section = ResMgr.openSection('../version.xml')
+    if section is None:
+        return None
+    return section.readString('version').strip() or None
+
+
+class ShellPriceTable:
+    def __init__(self, cache_file):
+        self._cache_file = cache_file
+        self._version = None
+        self._prices = None
+        self._is_dirty = False
+    def __getitem__(self, nation_id):
+        if self._prices is None:
+            self._load_cache()
+        if nation_id not in self._prices:
+            self._prices[nation_id] = load_shell_prices(nations.NAMES[nation_id])
+            self._is_dirty = True  # Saved at battle end rather than during the battle
+        return self._prices[nation_id]
+    def flush(self, *args):
+        if not self._is_dirty:
+            return
+        self._is_dirty = False
+        self._save_cache()
+    def _load_cache(self):
+        self._version, self._prices = get_game_version(), {}
+        if self._version is None or not os.path.exists(self._cache_file):
+            return
+        try:
+            with open(self._cache_file, 'rb') as cache_file:
+                cache = pickle.load(cache_file)
+            if cache.get('version') == self._version:
+                self._prices = cache['prices']
+        except Exception:
+            pass
+    def _save_cache(self):
+        if self._version is None:
+            return
+        try:
+            with open(self._cache_file, 'wb') as cache_file:
+                pickle.dump({'version': self._version, 'prices': self._prices}, cache_file, pickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError):
+            pass
+
+
 def get_pixie_effects(effects_list):
     effects_desc = effects_list._EffectsList__effectDescList
     return [desc for desc in effects_desc if isinstance(desc, _PixieEffectDesc)]
@@ -94,7 +199,7 @@ def get_gold_ammo_types_from_prices(shell_prices, default_gold_ammo_types, gun):
     gold_ammo_types = []
     for shot in gun.shots:
         nation_id, shell_id = shot.shell.id
-        gold_price = shell_prices[nation_id][shell_id].get('gold', None)
+        gold_price, _ = shell_prices[nation_id][shell_id]
         if gold_price is not None:
             gold_ammo_types.append(shot.shell.kind)
     if len(gold_ammo_types) > 0:
@@ -102,16 +207,17 @@ def get_gold_ammo_types_from_prices(shell_prices, default_gold_ammo_types, gun):
     credits_prices = []
     for shot in gun.shots:
         nation_id, shell_id = shot.shell.id
-        credits_price = shell_prices[nation_id][shell_id].get('credits', 0)
+        _, credits_price = shell_prices[nation_id][shell_id]
         credits_prices.append(credits_price)
     avg_price = reduce(lambda total, price: total + price, credits_prices, 0) / len(credits_prices)
     premium_shells = [index for (index, price) in enumerate(credits_prices) if price > avg_price]
     return map(lambda index: gun.shots[index].shell.kind, premium_shells)
 
 
+shell_price_table = ShellPriceTable(SHELL_PRICES_CACHE_FILE)
 get_gold_ammo_types = partial(
     get_gold_ammo_types_from_prices,
-    map(lambda nation: load_shell_prices(nation), nations.NAMES),
+    shell_price_table,
     []
 )
 
@@ -125,14 +231,6 @@ def get_team_id(player_id, players):
     return players.get(player_id, {}).get('team', None)
 
 
-def should_log_attacker(player, players, shell_type, gun, attacker_id):
-    return not(is_own_player(attacker_id, player, players) or is_gold_shell_type_ambiguous(shell_type, gun))
-
-
-def is_own_player(attacker_id, player, players):
-    return get_ingame_player_id(player, players) == attacker_id
-
-
 def is_gold_shell_type_ambiguous(shell_type, gun):
     if gun is None:
         return False
@@ -145,6 +243,33 @@ def is_gold_shell_type_ambiguous(shell_type, gun):
     return occ_in_shell_types > occ_in_gold_shell_types
 
 
+class AttackerCache:
+    def __init__(self):
+        self._arena_key = None
+        self._own_player_id = None
+        self._attackers = {}
+    def get_attacker(self, player, attacker_id):
+        arena_key = (getattr(player, 'arenaUniqueID', None), id(player.arena))
+        if arena_key != self._arena_key:
+            self._arena_key = arena_key
+            self._own_player_id = get_ingame_player_id(player, player.arena.vehicles)
+            self._attackers = {}
+        if attacker_id not in self._attackers:
+            players = player.arena.vehicles
+            if attacker_id not in players:
+                return None
+            self._attackers[attacker_id] = self._classify_attacker(attacker_id, players)
+        return self._attackers[attacker_id]
+    def _classify_attacker(self, attacker_id, players):
+        logged_shell_types = set()
+        if attacker_id != self._own_player_id:
+            gun = get_gun(attacker_id, players)
+            for shell_type in get_gold_ammo_types(gun):
+                if not is_gold_shell_type_ambiguous(shell_type, gun):
+                    logged_shell_types.add(shell_type)
+        return players[attacker_id]['name'], players[attacker_id]['accountDBID'], logged_shell_types
+
+
 def shell_type_from_effect_name(effect_name):
     shell_type = 'ARMOR_PIERCING'
     if '_AP_CR' in effect_name.upper():
@@ -156,29 +281,47 @@ def shell_type_from_effect_name(effect_name):
     return shell_type
 
 
-def restore_with_mgr_and_modify_effect(modified_file_name_mgr, effects_list, attacker_id):
+def get_effect_shell_type(file_path):
+    if file_path not in effect_shell_types:
+        match = SHELL_EFFECT_PATTERN.search(file_path)
+        effect_shell_types[file_path] = shell_type_from_effect_name(match.group(1)) if match is not None else None
+    return effect_shell_types[file_path]
+
+
+def restore_with_mgr_and_modify_effect(modified_file_name_mgr, attacker_cache, log_writer, effects_list, attacker_id):
     modified_file_name_mgr.restore()
     player = BigWorld.player()
-    players = player.arena.vehicles
-    gun = get_gun(attacker_id, players)
-    gold_ammo_types = get_gold_ammo_types(gun)
+    attacker = attacker_cache.get_attacker(player, attacker_id)
+    if attacker is None:
+        return
+    attacker_name, attacker_dbid, logged_shell_types = attacker
+    if not logged_shell_types or attacker_name in gold_users:
+        return
     pixie_effects = get_pixie_effects(effects_list)
     for pixie_effect in pixie_effects:
-        for (index, file_path) in enumerate(pixie_effect._files):
-            match = re.search('^particles/Shells_Eff/([a-zA-Z0-9_-]+)\.xml$', file_path)
-            if match is not None:
-                effect_name = match.group(1)
-                shell_type = shell_type_from_effect_name(effect_name)
-                if shell_type in gold_ammo_types and should_log_attacker(player, players, shell_type, gun, attacker_id):
-                    attacker_name = players[attacker_id]['name']
-                    attacker_dbid = players[attacker_id]['accountDBID']
-                    if attacker_name not in gold_users:
-                        log_gold_user(attacker_name, attacker_dbid)
+        for file_path in pixie_effect._files:
+            shell_type = get_effect_shell_type(file_path)
+            if shell_type in logged_shell_types:
+                log_writer.add(attacker_name, attacker_dbid, getattr(player, 'arenaUniqueID', 0), shell_type)
+                return
 
 
 prepare_log_file()
 
-restore_and_modify_effect = partial(restore_with_mgr_and_modify_effect, ModifiedValueManager())
+gold_user_log_writer = GoldUserLogWriter(LOG_FILE)
+g_playerEvents.onAvatarBecomeNonPlayer += gold_user_log_writer.flush  # Flush at battle end
+g_playerEvents.onAvatarBecomeNonPlayer += shell_price_table.flush
+if hook_profiler is not None:
+    g_playerEvents.onAvatarBecomeNonPlayer += hook_profiler.dump
+restore_and_modify_effect = partial(
+    restore_with_mgr_and_modify_effect, ModifiedValueManager(), AttackerCache(), gold_user_log_writer
+)
+
+
+@run_before(game, 'fini')
+def flush_gold_user_log(*args, **kwargs):
+    gold_user_log_writer.flush()
+    shell_price_table.flush()
 
 
 @run_before(StaticSceneBoundEffects, 'addNew')
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+"""Serve a local imitation of the WG API with synthetic deterministic accounts, for load and regression testing."""
+
+import re
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import functools
+import socketserver
+from urllib.parse import urlparse, parse_qs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_PORT = 8642
+ID_LOWER_BOUND = 500000000
+ID_UPPER_BOUND = 560000000
+FIRST_CREATION_TIMESTAMP = 1281000000
+LAST_CREATION_TIMESTAMP = 1700000000
+NICKNAME_FORMAT = 'player_%d'
+NICKNAME_PATTERN = re.compile(r'^player_(\d+)$', re.IGNORECASE)
+CLIENT_LANGUAGES = ['en', 'fr', 'de', 'pl', 'ru', 'es', 'cs', 'tr', 'it']
+TANK_COUNT = 600
+MAX_TANKS_PER_ACCOUNT = 120
+MISSING_EXP_VALUES_RATIO = 0.05
+MAX_IDS_PER_REQUEST = 100
+EXP_VALUES_PATH = '/wn8exp.json'
+ERRORS = {
+    'REQUEST_LIMIT_EXCEEDED': 407,
+    'ACCOUNT_ID_LIST_LIMIT_EXCEEDED': 407,
+    'SOURCE_NOT_AVAILABLE': 504,
+    'METHOD_NOT_FOUND': 404
+}
+TANK_IDS = [(index << 8) + (index % 8 << 4) + 1 for index in range(1, TANK_COUNT + 1)]
+
+
+@functools.lru_cache(maxsize=None)
+def get_tank_exp_values(tank_id, seed):
+    """Generate the WN8 expected values of a tank."""
+    generator = random.Random('exp:%d:%d' % (seed, tank_id))
+    tier_factor = generator.uniform(0.2, 1)
+    return {
+        'damage_ratio': 2500 * tier_factor * generator.uniform(0.7, 1.1),
+        'spot_ratio': generator.uniform(0.6, 2),
+        'kill_ratio': generator.uniform(0.6, 1.3),
+        'defense_ratio': generator.uniform(0.4, 1.5),
+        'win_ratio': generator.uniform(48, 54),
+        'has_exp_values': generator.random() > MISSING_EXP_VALUES_RATIO
+    }
+
+
+def get_exp_values_d(seed=0):
+    """Generate the WN8 expected values of all tanks, as loaded by wn8_utils."""
+    exp_values_d = {}
+    for tank_id in TANK_IDS:
+        tank_exp_values = dict(get_tank_exp_values(tank_id, seed))
+        if tank_exp_values.pop('has_exp_values'):
+            exp_values_d[tank_id] = tank_exp_values
+    return exp_values_d
+
+
+def get_exp_values_json(seed=0):
+    """Generate the WN8 expected values of all tanks, in the format of the XVM file."""
+    return {
+        'header': {'source': 'api_mock_server', 'version': 'mock-%d' % seed},
+        'data': [{
+            'IDNum': tank_id,
+            'expDamage': round(tank_exp_values['damage_ratio'], 2),
+            'expSpot': round(tank_exp_values['spot_ratio'], 2),
+            'expFrag': round(tank_exp_values['kill_ratio'], 2),
+            'expDef': round(tank_exp_values['defense_ratio'], 2),
+            'expWinRate': round(tank_exp_values['win_ratio'], 2)
+        } for tank_id, tank_exp_values in get_exp_values_d(seed).items()]
+    }
+
+
+@functools.lru_cache(maxsize=10000)
+def generate_account(account_id, seed=0, account_ratio=1.0):
+    """Generate the profile and per-tank stats of an account, or None if the id is not registered."""
+    if not ID_LOWER_BOUND <= account_id <= ID_UPPER_BOUND:
+        return None
+    generator = random.Random('account:%d:%d' % (seed, account_id))
+    if generator.random() >= account_ratio:
+        return None
+
+    skill = generator.gauss(0, 1)
+    tanks = []
+    for tank_id in sorted(generator.sample(TANK_IDS, generator.randint(1, MAX_TANKS_PER_ACCOUNT))):
+        exp_values = get_tank_exp_values(tank_id, seed)
+        performance = math.exp(0.3 * skill + 0.15 * generator.gauss(0, 1))
+        battles = int(generator.paretovariate(1.2) * 8)
+        shots = int(battles * generator.uniform(5, 12))
+        tanks.append({
+            'tank_id': tank_id,
+            'mark_of_mastery': generator.randint(0, 4) if battles > 0 else 0,
+            'all': {
+                'battles': battles,
+                'wins': min(battles, int(battles * exp_values['win_ratio'] / 100 * (1 + 0.06 * skill))),
+                'damage_dealt': int(battles * exp_values['damage_ratio'] * performance),
+                'spotted': int(battles * exp_values['spot_ratio'] * performance),
+                'frags': int(battles * exp_values['kill_ratio'] * performance),
+                'dropped_capture_points': int(battles * exp_values['defense_ratio'] * performance),
+                'capture_points': int(battles * generator.uniform(0.5, 3)),
+                'shots': shots,
+                'hits': int(shots * min(0.95, 0.75 + 0.05 * skill)),
+                'explosion_hits': int(battles * generator.uniform(0, 1.5)),
+                'xp': int(battles * 500 * performance)
+            }
+        })
+
+    totals = {field: sum(tank['all'][field] for tank in tanks) for field in tanks[0]['all']}
+    battles = totals.pop('battles')
+    xp = totals.pop('xp')
+    statistics = dict(totals, battles=battles)
+    statistics['battle_avg_xp'] = int(xp / battles) if battles > 0 else 0
+    statistics['survived_battles'] = int(battles * min(0.9, max(0.05, 0.3 + 0.08 * skill)))
+    statistics['damage_received'] = int(totals['damage_dealt'] / math.exp(0.35 * skill))
+    statistics['avg_damage_assisted'] = round(generator.uniform(100, 700) * math.exp(0.2 * skill), 2)
+    statistics['avg_damage_blocked'] = round(generator.uniform(50, 600), 2)
+    creation_ratio = (account_id - ID_LOWER_BOUND) / (ID_UPPER_BOUND - ID_LOWER_BOUND)
+    created_at = int(FIRST_CREATION_TIMESTAMP + creation_ratio * (LAST_CREATION_TIMESTAMP - FIRST_CREATION_TIMESTAMP))
+    return {
+        'info': {
+            'account_id': account_id,
+            'nickname': NICKNAME_FORMAT % account_id,
+            'created_at': created_at,
+            'last_battle_time': created_at + int(generator.uniform(0, LAST_CREATION_TIMESTAMP - created_at)),
+            'global_rating': int(max(0, 5000 + 2000 * skill) * min(1, battles / 3000)),
+            'client_language': generator.choice(CLIENT_LANGUAGES),
+            'statistics': {'all': statistics}
+        },
+        'tanks': tanks
+    }
+
+
+def select_fields(data, fields):
+    """Keep only the given dotted fields of response data, or exclude those prefixed with '-', as done by the WG API."""
+    if isinstance(data, list):
+        return [select_fields(item, fields) for item in data]
+    if not isinstance(data, dict) or not fields:
+        return data
+    included_fields = [field for field in fields if not field.startswith('-')]
+    excluded_fields = [field[1:] for field in fields if field.startswith('-')]
+    if included_fields:
+        selected_data = {}
+        for field in included_fields:
+            source, target = data, selected_data
+            field_parts = field.split('.')
+            for field_part in field_parts[:-1]:
+                if not isinstance(source, dict) or field_part not in source:
+                    break
+                source, target = source[field_part], target.setdefault(field_part, {})
+            else:
+                if isinstance(source, dict) and field_parts[-1] in source:
+                    target[field_parts[-1]] = source[field_parts[-1]]
+    else:
+        selected_data = json.loads(json.dumps(data))
+    for field in excluded_fields:
+        target = selected_data
+        field_parts = field.split('.')
+        for field_part in field_parts[:-1]:
+            target = target.get(field_part, {}) if isinstance(target, dict) else {}
+        if isinstance(target, dict):
+            target.pop(field_parts[-1], None)
+    return selected_data
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """Answer each request in its own thread, as http.server.ThreadingHTTPServer which requires Python 3.7."""
+    daemon_threads = True
+
+
+class MockApiRequestHandler(BaseHTTPRequestHandler):
+    """Answer WG API requests with generated accounts, delays and injected errors."""
+    seed = 0
+    account_ratio = 0.5
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    limit_rate = 0.0
+    max_requests_per_second = 0
+    lock = threading.Lock()
+    error_generator = random.Random(0)
+    window = {'second': 0, 'requests': 0}
+    counters = {'requests': 0, 'accounts': 0, 'errors': 0, 'limits': 0, 'bytes': 0}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == EXP_VALUES_PATH:
+            self.send_exp_values()
+            return
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        endpoint = url.path.strip('/')
+        endpoint = endpoint[len('wot/'):] if endpoint.startswith('wot/') else endpoint
+        parameters = {key: values[0] for key, values in parse_qs(url.query).items()}
+        fields = [field.strip() for field in parameters.get('fields', '').split(',') if field.strip()]
+        error = self.get_injected_error()
+        if error:
+            self.send_json({'status': 'error', 'error': {
+                'field': None, 'message': error, 'code': ERRORS[error], 'value': None
+            }})
+        elif endpoint == 'account/list':
+            self.send_data(self.list_accounts(parameters), fields)
+        elif endpoint in ('account/info', 'account/tanks', 'tanks/stats'):
+            account_ids = [account_id for account_id in parameters.get('account_id', '').split(',') if account_id]
+            if len(account_ids) > MAX_IDS_PER_REQUEST:
+                self.send_json({'status': 'error', 'error': {
+                    'field': 'account_id', 'message': 'ACCOUNT_ID_LIST_LIMIT_EXCEEDED', 'code': 407, 'value': None
+                }})
+            else:
+                self.send_data(self.get_accounts_data(endpoint, account_ids, parameters), fields)
+        else:
+            self.send_json({'status': 'error', 'error': {
+                'field': None, 'message': 'METHOD_NOT_FOUND', 'code': ERRORS['METHOD_NOT_FOUND'], 'value': None
+            }})
+
+    def get_injected_error(self):
+        """Draw an error to answer with, according to the error rates and the request rate limit."""
+        with self.lock:
+            self.counters['requests'] += 1
+            if self.max_requests_per_second:
+                second = int(time.time())
+                if self.window['second'] != second:
+                    self.window['second'], self.window['requests'] = second, 0
+                self.window['requests'] += 1
+                if self.window['requests'] > self.max_requests_per_second:
+                    self.counters['limits'] += 1
+                    return 'REQUEST_LIMIT_EXCEEDED'
+            draw = self.error_generator.random()
+            if draw < self.limit_rate:
+                self.counters['limits'] += 1
+                return 'REQUEST_LIMIT_EXCEEDED'
+            if draw < self.limit_rate + self.error_rate:
+                self.counters['errors'] += 1
+                return 'SOURCE_NOT_AVAILABLE'
+        return None
+
+    def list_accounts(self, parameters):
+        """Find registered accounts by exact nickname."""
+        accounts = []
+        for nickname in parameters.get('search', '').split(',')[:MAX_IDS_PER_REQUEST]:
+            match = NICKNAME_PATTERN.match(nickname.strip())
+            account = generate_account(int(match.group(1)), self.seed, self.account_ratio) if match else None
+            if account:
+                accounts.append({'nickname': account['info']['nickname'], 'account_id': account['info']['account_id']})
+        return accounts
+
+    def get_accounts_data(self, endpoint, account_ids, parameters):
+        """Collect the account or per-tank data of the requested accounts."""
+        tank_ids = {int(tank_id) for tank_id in parameters.get('tank_id', '').split(',') if tank_id}
+        accounts_data = {}
+        for account_id in account_ids:
+            account = generate_account(int(account_id), self.seed, self.account_ratio) if account_id.isdigit() else None
+            if account is None:
+                accounts_data[account_id] = None
+            elif endpoint == 'account/info':
+                accounts_data[account_id] = account['info']
+            elif endpoint == 'account/tanks':
+                accounts_data[account_id] = [{
+                    'tank_id': tank['tank_id'],
+                    'mark_of_mastery': tank['mark_of_mastery'],
+                    'statistics': {'battles': tank['all']['battles'], 'wins': tank['all']['wins']}
+                } for tank in account['tanks']]
+            else:
+                accounts_data[account_id] = [
+                    {'tank_id': tank['tank_id'], 'account_id': int(account_id), 'all': tank['all']}
+                    for tank in account['tanks'] if not tank_ids or tank['tank_id'] in tank_ids
+                ]
+        with self.lock:
+            self.counters['accounts'] += len(account_ids)
+        return accounts_data
+
+    def send_data(self, data, fields):
+        """Answer with the data restricted to the requested fields."""
+        if isinstance(data, dict):
+            data = {key: select_fields(value, fields) if value is not None else None for key, value in data.items()}
+        else:
+            data = select_fields(data, fields)
+        self.send_json({'status': 'ok', 'meta': {'count': len(data)}, 'data': data})
+
+    def send_exp_values(self):
+        """Answer with the WN8 expected values, or nothing if not modified since the last download."""
+        etag = '"mock-%d"' % self.seed
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_json(get_exp_values_json(self.seed), {'ETag': etag})
+
+    def send_json(self, content, headers=None):
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.lock:
+            self.counters['bytes'] += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port=0, seed=0, account_ratio=0.5, latency=0.0, jitter=0.0, error_rate=0.0, limit_rate=0.0,
+                 max_requests_per_second=0):
+    """Serve the mock API from a background thread and return the server along with its base URL."""
+    handler = type('ConfiguredMockApiRequestHandler', (MockApiRequestHandler,), {
+        'seed': seed,
+        'account_ratio': account_ratio,
+        'latency': latency,
+        'jitter': jitter,
+        'error_rate': error_rate,
+        'limit_rate': limit_rate,
+        'max_requests_per_second': max_requests_per_second,
+        'lock': threading.Lock(),
+        'error_generator': random.Random(seed),
+        'window': {'second': 0, 'requests': 0},
+        'counters': {'requests': 0, 'accounts': 0, 'errors': 0, 'limits': 0, 'bytes': 0}
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{port}/wot/'.format(port=server.server_address[1])
+    return server, base_url
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description="Serve a local imitation of the WG API with synthetic accounts.")
+    argument_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="listening port")
+    argument_parser.add_argument('--seed', type=int, default=0, help="seed of the generated accounts")
+    argument_parser.add_argument('--account-ratio', type=float, default=0.5, help="share of ids in bounds that are registered accounts")
+    argument_parser.add_argument('--latency', type=float, default=0, help="delay of each answer in milliseconds")
+    argument_parser.add_argument('--jitter', type=float, default=0, help="maximum random delay added to each answer in milliseconds")
+    argument_parser.add_argument('--error-rate', type=float, default=0, help="share of requests answered with SOURCE_NOT_AVAILABLE")
+    argument_parser.add_argument('--limit-rate', type=float, default=0, help="share of requests answered with REQUEST_LIMIT_EXCEEDED")
+    argument_parser.add_argument('--max-rps', type=int, default=0, help="requests per second above which REQUEST_LIMIT_EXCEEDED is answered (0 for no limit)")
+    arguments = argument_parser.parse_args()
+
+    server, base_url = start_server(
+        arguments.port, arguments.seed, arguments.account_ratio, arguments.latency / 1000, arguments.jitter / 1000,
+        arguments.error_rate, arguments.limit_rate, arguments.max_rps
+    )
+    print("Mock WG API listening. Add the following lines to the config file to use it:")
+    print("  WG_API_BASE_URL={url}".format(url=base_url))
+    print("  WN8_EXP_VALUES_URL=http://127.0.0.1:{port}{path}".format(port=server.server_address[1], path=EXP_VALUES_PATH))
+    print("Press CTRL + C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        counters = server.RequestHandlerClass.counters
+        print("\nServed {requests} requests for {accounts} accounts ({bytes} bytes), "
+              "injected {errors} errors and {limits} request limits.".format(**counters))
+        server.shutdown()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""Provide the locations of the remote services used by the scripts."""
+
+import time
+
+import requests
+
+import timing_utils
+import ui_utils
+
+API_BASE_URL = 'https://api.worldoftanks.eu/wot/'
+EXP_VALUES_FILE_URL = 'https://static.modxvm.com/wn8-data-exp/json/wn8exp.json'
+REQUEST_RETRIES = 5
+RETRY_DELAY = 0.5  # Seconds before the first retry, doubled at each retry
+
+
+def get_request_url(endpoint):
+    """Build the request URL of a WG API endpoint, e.g. 'account/info'."""
+    return '{base_url}{endpoint}/'.format(base_url=API_BASE_URL, endpoint=endpoint)
+
+
+def request(endpoint, payload):
+    """Request a WG API endpoint and decode its response, retrying with backoff while the request limit is exceeded."""
+    for retry in range(REQUEST_RETRIES + 1):
+        if retry > 0:
+            timing_utils.count('request retries')
+            time.sleep(RETRY_DELAY * 2 ** (retry - 1))
+        with timing_utils.stage('api request'):
+            response = requests.get(get_request_url(endpoint), params=payload)
+        with timing_utils.stage('json decode'):
+            response_content = response.json()
+        timing_utils.count('requests')
+        timing_utils.count('bytes received', len(response.content))
+        if not is_request_limit_exceeded(response_content):
+            break
+    return response_content
+
+
+def is_request_limit_exceeded(response_content):
+    """Tell whether the WG API refused a request because too many requests were sent."""
+    return response_content['status'] == 'error' and response_content['error']['message'] == 'REQUEST_LIMIT_EXCEEDED'
+
+
+def load_api_urls(config_file):
+    """Load custom locations of the WG API and of the WN8 expected values from config."""
+    global API_BASE_URL, EXP_VALUES_FILE_URL
+    api_base_url = ui_utils.load_config_value(config_file, 'WG_API_BASE_URL')
+    if api_base_url:
+        API_BASE_URL = api_base_url.rstrip('/') + '/'
+        print("Custom WG API location loaded from config: {url}".format(url=API_BASE_URL))
+    exp_values_file_url = ui_utils.load_config_value(config_file, 'WN8_EXP_VALUES_URL')
+    if exp_values_file_url:
+        EXP_VALUES_FILE_URL = exp_values_file_url
+        print("Custom WN8 expected values location loaded from config: {url}".format(url=EXP_VALUES_FILE_URL))
+
+
+def set_api_urls(api_base_url, exp_values_file_url):
+    """Point the scripts at the given locations, e.g. in a child process."""
+    global API_BASE_URL, EXP_VALUES_FILE_URL
+    API_BASE_URL, EXP_VALUES_FILE_URL = api_base_url, exp_values_file_url
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark the image, WN8 and data loading hot paths on synthetic data, offline."""
+
+import io
+import os
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+import numpy as np
+from PIL import Image
+
+import stat_enum  # Imported before player_profiler to resolve their circular import
+import player_profiler as profiler
+import api_mock_server
+import api_utils
+import image_utils
+import wn8_utils
+
+DATA_FOLDER = '../../data'
+BENCHMARKS_FOLDER = '{data_folder}/benchmarks'.format(data_folder=DATA_FOLDER)
+BASELINE_FILE = '{benchmarks_folder}/baseline.json'.format(benchmarks_folder=BENCHMARKS_FOLDER)
+CATEGORY_COLORS = {
+    'ASSHOLE': (237, 28, 36, 255),
+    'CAMPER': (163, 73, 164, 255),
+    'GOLD': (255, 201, 14, 255),
+    'REROLL': (0, 0, 0, 255),
+    'TEAMKILL': (3, 225, 237, 255)
+}
+IMAGE_SIZE = 64
+STRAY_PIXELS = 6
+NOISY_PIXELS = 700  # Pixels of random colors, beyond the colors of an adaptive palette
+ID_OFFSET = api_mock_server.ID_LOWER_BOUND
+SEED = 7
+
+
+def generate_zlist(folder, player_count, stray_pixels=0, seed=SEED):
+    """Generate category PNG files and player PNG files of one or two categories, with stray pixels."""
+    generator = random.Random(seed)
+    categories = sorted(CATEGORY_COLORS)
+    for category in categories:
+        Image.new('RGBA', (IMAGE_SIZE, IMAGE_SIZE), CATEGORY_COLORS[category]).save(
+            os.path.join(folder, '.{category}.png'.format(category=category))
+        )
+    for index in range(player_count):
+        player_categories = generator.sample(categories, 1 if generator.random() < 0.9 else 2)
+        image = Image.new('RGBA', (IMAGE_SIZE, IMAGE_SIZE), CATEGORY_COLORS[player_categories[0]])
+        if len(player_categories) > 1:
+            image.paste(CATEGORY_COLORS[player_categories[1]], (IMAGE_SIZE // 2, 0, IMAGE_SIZE, IMAGE_SIZE))
+        for _ in range(stray_pixels):
+            x, y = generator.randrange(IMAGE_SIZE), generator.randrange(IMAGE_SIZE)
+            r, g, b, a = image.getpixel((x, y))
+            image.putpixel((x, y), (min(255, r + 12), max(0, g - 9), min(255, b + 5), a))
+        image.save(os.path.join(folder, 'player{index}.png'.format(index=index)))
+
+
+def generate_noisy_image(noisy_pixels, seed=SEED):
+    """Generate a player image of two categories with pixels of random colors, as left by anti-aliasing."""
+    generator = np.random.default_rng(seed)
+    pixels = np.empty((IMAGE_SIZE, IMAGE_SIZE, 4), dtype=np.uint8)
+    pixels[:, :IMAGE_SIZE // 2] = CATEGORY_COLORS['ASSHOLE']
+    pixels[:, IMAGE_SIZE // 2:] = CATEGORY_COLORS['REROLL']
+    noisy_indexes = generator.choice(IMAGE_SIZE * IMAGE_SIZE, noisy_pixels, replace=False)
+    pixels.reshape(-1, 4)[noisy_indexes, :3] = generator.integers(0, 256, (noisy_pixels, 3))
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def generate_server_file(file_path, account_count):
+    """Generate a SERVER.csv file of given size."""
+    with open(file_path, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',')
+        for index in range(account_count):
+            csv_writer.writerow(['player{index}'.format(index=index), ID_OFFSET + index])
+
+
+def measure(function, item_count, repeat):
+    """Measure the best throughput of a function over several runs, then its peak memory."""
+    best_duration = float('inf')
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            best_duration = min(best_duration, time.perf_counter() - start)
+        tracemalloc.start()
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {'items': item_count, 'seconds': best_duration, 'items_per_second': item_count / best_duration, 'peak_mb': peak_memory / 2 ** 20}
+
+
+def categorize_folder(folder):
+    """Count the colors of every player file of a ZList folder, repair and categorize them."""
+    category_palette = image_utils.get_category_palette(folder, sorted(CATEGORY_COLORS))
+    for file_name in os.listdir(folder):
+        if not file_name.startswith('.'):
+            colors_data, _ = image_utils.get_player_colors(folder, file_name)
+            image_utils.get_color_categories(colors_data, category_palette)
+
+
+def repair_image(image):
+    """Repair an image, checking that only major colors remain."""
+    repaired_image, _ = image_utils.get_repaired_image(image)
+    if not image_utils.get_color_stats(np.asarray(repaired_image))['is_major'].all():
+        raise RuntimeError("The repaired image still has minor colors.")
+
+
+def run_benchmarks(image_count, account_count, set_sizes, repeat):
+    """Generate synthetic data in a temporary folder and run each benchmark on it."""
+    results = {}
+    work_folder = tempfile.mkdtemp(prefix='zlist_benchmark_')
+    try:
+        clean_folder, damaged_folder = os.path.join(work_folder, 'clean'), os.path.join(work_folder, 'damaged')
+        for folder, stray_pixels in ((clean_folder, 0), (damaged_folder, STRAY_PIXELS)):
+            os.makedirs(folder)
+            generate_zlist(folder, image_count, stray_pixels)
+        results['categorization'] = measure(lambda: categorize_folder(clean_folder), image_count, repeat)
+        results['repair'] = measure(lambda: categorize_folder(damaged_folder), image_count, repeat)
+        image_stack = np.stack([
+            np.asarray(Image.open(os.path.join(damaged_folder, file_name)).convert('RGBA'))
+            for file_name in os.listdir(damaged_folder) if not file_name.startswith('.')
+        ])
+        noisy_image = generate_noisy_image(NOISY_PIXELS)
+        results['noisy_repair'] = measure(lambda: repair_image(noisy_image), 1, repeat)
+        results['color_stats_batch'] = measure(lambda: image_utils.get_color_stats(image_stack), len(image_stack), repeat)
+
+        api_urls = api_utils.API_BASE_URL, api_utils.EXP_VALUES_FILE_URL
+        server, api_base_url = api_mock_server.start_server(seed=SEED, account_ratio=1)
+        try:
+            api_utils.set_api_urls(api_base_url, api_utils.EXP_VALUES_FILE_URL)
+            exp_values_d = api_mock_server.get_exp_values_d(SEED)
+            player_ids = [str(ID_OFFSET + index) for index in range(account_count)]
+            results['wn8'] = measure(lambda: wn8_utils.calculate_wn8(player_ids, exp_values_d), account_count, repeat)
+        finally:
+            server.shutdown()
+            api_utils.set_api_urls(*api_urls)  # Restored for callers running the suite in the same process
+
+        for set_size in set_sizes:
+            server_file_path = os.path.join(work_folder, 'SERVER_{size}.csv'.format(size=set_size))
+            generate_server_file(server_file_path, set_size)
+            results['set_loading_{size}'.format(size=set_size)] = measure(
+                lambda: profiler.load_player_ids_sets([[server_file_path]]), set_size, repeat
+            )
+    finally:
+        shutil.rmtree(work_folder)
+    return results
+
+
+def print_results(results, baseline):
+    """Print throughput and peak memory of benchmarks, compared to the baseline if any."""
+    print("{:<22}{:>10}{:>12}{:>14}{:>12}{:>12}".format("benchmark", "items", "seconds", "items/s", "peak MB", "vs base"))
+    for name, result in results.items():
+        comparison = ''
+        if name in baseline:
+            comparison = "x{ratio:.2f}".format(ratio=result['items_per_second'] / baseline[name]['items_per_second'])
+        print("{:<22}{:>10}{:>12.3f}{:>14.1f}{:>12.2f}{:>12}".format(
+            name, result['items'], result['seconds'], result['items_per_second'], result['peak_mb'], comparison
+        ))
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description="Benchmark the hot paths of the scripts on synthetic data.")
+    argument_parser.add_argument('--images', type=int, default=2000, help="number of generated player PNG files")
+    argument_parser.add_argument('--accounts', type=int, default=1000, help="number of accounts served for WN8")
+    argument_parser.add_argument('--set-sizes', type=int, nargs='+', default=[1000, 4000, 16000], help="sizes of generated SERVER.csv files")
+    argument_parser.add_argument('--repeat', type=int, default=3, help="number of timed runs of each benchmark")
+    argument_parser.add_argument('--save-baseline', action='store_true', help="register results as the new baseline")
+    arguments = argument_parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = run_benchmarks(arguments.images, arguments.accounts, arguments.set_sizes, max(1, arguments.repeat))
+    print_results(results, baseline)
+
+    if arguments.save_baseline:
+        if not os.path.isdir(BENCHMARKS_FOLDER):
+            os.makedirs(BENCHMARKS_FOLDER)
+        with open(BASELINE_FILE, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print("Baseline registered to {file}.".format(file=os.path.abspath(BASELINE_FILE)))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""Compile stat expressions over fields of the WG API, e.g. 'statistics.all.wins / statistics.all.battles * 100'."""
+
+import ast
+import operator
+import functools
+
+import numpy as np
+
+OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_expression(expression):
+    """Compile an expression of dotted fields, numbers, +, -, *, / and parentheses, once per run."""
+    fields = []
+    evaluator = compile_node(ast.parse(expression, mode='eval').body, fields, expression)
+    return {
+        'expression': expression,
+        'fields': fields,
+        'evaluator': evaluator
+    }
+
+
+def compile_node(node, fields, expression):
+    """Compile a node of the syntax tree of an expression into a function of the field columns."""
+    if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        left, right = compile_node(node.left, fields, expression), compile_node(node.right, fields, expression)
+        numpy_operator = OPERATORS[type(node.op)]
+        return lambda columns: numpy_operator(left(columns), right(columns))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        operand = compile_node(node.operand, fields, expression)
+        return lambda columns: np.negative(operand(columns))
+    value = get_number(node)
+    if value is not None:
+        return lambda columns: value
+    field = get_field(node)
+    if field is None:
+        raise ValueError("Unsupported element in stat expression '{expression}': {element}".format(
+            expression=expression, element=ast.dump(node)
+        ))
+    if field not in fields:
+        fields.append(field)
+    field_index = fields.index(field)
+    return lambda columns: columns[field_index]
+
+
+def get_number(node):
+    """Get the value of a numeric literal node, or None if it is not a number."""
+    if isinstance(node, ast.Constant):
+        value = node.value
+    elif type(node).__name__ == 'Num':  # Numeric literals of Python 3.7 and older
+        value = node.n
+    else:
+        return None
+    return float(value) if type(value) in (int, float) else None
+
+
+def get_field(node):
+    """Get the dotted field named by a node, or None if it is not a field."""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        parent_field = get_field(node.value)
+        return '{parent}.{name}'.format(parent=parent_field, name=node.attr) if parent_field else None
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def compile_accessor(field):
+    """Compile a dotted field into a chain of item getters on the data of a player."""
+    getters = [operator.itemgetter(field_part) for field_part in field.split('.')]
+
+    def accessor(data):
+        for getter in getters:
+            data = getter(data)
+        return data
+    return accessor
+
+
+def get_columns(fields, players_data):
+    """Get the value of each field for a batch of players, as one float64 column per field, NaN where null."""
+    accessors = [compile_accessor(field) for field in fields]
+    return [np.array([accessor(player_data) for player_data in players_data], dtype=np.float64) for accessor in accessors]
+
+
+def evaluate_expression(compiled_expression, players_data):
+    """Evaluate a compiled expression over the data of a batch of players, NaN where undefined."""
+    return evaluate_columns(compiled_expression, get_columns(compiled_expression['fields'], players_data), len(players_data))
+
+
+def evaluate_columns(compiled_expression, columns, player_count):
+    """Evaluate a compiled expression over the columns of its fields, NaN where undefined."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = np.broadcast_to(compiled_expression['evaluator'](columns), player_count).astype(np.float64)
+    stats[~np.isfinite(stats)] = np.nan
+    return stats
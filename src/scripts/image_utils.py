@@ -3,9 +3,19 @@
 """Provide image manipulation functions for player category detection."""
 
 import os
+import re
+import zlib
+import struct
 
+import numpy as np
 from PIL import Image
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # Per color type: grayscale, RGB, palette, grayscale alpha, RGBA
+MAX_PALETTE_COLORS = 256  # Most colors of an adaptive palette
+MAX_SCANLINE_RUNS = 16  # Non-zero bytes of a Sub scanline above which arrays are faster to unfilter it
+NON_ZERO_BYTE_PATTERN = re.compile(b'[^\x00]')
+
 
 def get_category_palette(folder, main_categories):
     """Map colors to main categories."""
@@ -28,38 +38,204 @@ def get_player_image(folder, file_name):
     return image, repaired
 
 
+def get_player_colors(folder, file_name):
+    """Count the colors of the PNG file assigned to a player, merging minor colors as done by image repair."""
+    image_size, colors_data = read_png_colors(os.path.join(folder, file_name))
+    if colors_data is None:  # Not handled by the PNG reader
+        image = Image.open(os.path.join(folder, file_name)).convert('RGBA')
+        image_size = image.size[0] * image.size[1]
+        colors_data = image.getcolors(image_size)
+    return get_repaired_colors(colors_data, image_size)
+
+
+def read_png_colors(file_path):
+    """Count the RGBA colors of a non-interlaced 8-bit PNG file, or give no colors data for files it cannot read."""
+    with open(file_path, 'rb') as png_file:
+        content = png_file.read()
+    if content[:8] != PNG_SIGNATURE:
+        return 0, None
+    position, header, palette, transparency, compressed_data = 8, None, None, None, []
+    while position + 8 <= len(content):
+        length, chunk_type = struct.unpack('>I4s', content[position:position + 8])
+        chunk_data = content[position + 8:position + 8 + length]
+        position += 12 + length
+        if chunk_type == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk_data)
+        elif chunk_type == b'PLTE':
+            palette = chunk_data
+        elif chunk_type == b'tRNS':
+            transparency = chunk_data
+        elif chunk_type == b'IDAT':
+            compressed_data.append(chunk_data)
+        elif chunk_type == b'IEND':
+            break
+    if header is None:
+        return 0, None
+    width, height, bit_depth, color_type, _, _, interlace = header
+    channels = PNG_CHANNELS.get(color_type)
+    if channels is None or bit_depth != 8 or interlace != 0 or (transparency is not None and color_type != 3):
+        return 0, None
+    if color_type == 3 and palette is None:
+        return 0, None
+    try:
+        raw_data = zlib.decompress(b''.join(compressed_data))
+    except zlib.error:
+        return 0, None
+    if len(raw_data) != height * (width * channels + 1):
+        return 0, None
+
+    raw_color_counts = count_scanline_runs(raw_data, width, channels)
+    if raw_color_counts is None:
+        raw_color_counts = count_unfiltered_colors(raw_data, width, height, channels)
+    if raw_color_counts is None:
+        return 0, None
+    color_counts = {}
+    for raw_color, count in raw_color_counts.items():
+        color = get_rgba_color(raw_color, color_type, palette, transparency)
+        if color is None:
+            return 0, None
+        color_counts[color] = color_counts.get(color, 0) + count
+    return width * height, [(count, color) for color, count in color_counts.items()]
+
+
+def count_scanline_runs(raw_data, width, channels):
+    """Count the raw colors of filtered scanlines made of a few runs of equal pixels, or None for other scanlines."""
+    stride = width * channels + 1
+    zero_scanline = bytes(stride - 1)
+    raw_color_counts, runs = {}, None
+    for scanline_start in range(0, len(raw_data), stride):
+        filter_type, scanline = raw_data[scanline_start], raw_data[scanline_start + 1:scanline_start + stride]
+        if filter_type == 2 and runs is not None:  # Up
+            if scanline != zero_scanline:
+                return None
+        elif filter_type == 1:  # Sub
+            runs = get_sub_scanline_runs(scanline, width, channels, zero_scanline)
+            if runs is None:
+                return None
+        elif filter_type in (0, 2):  # None, or Up on the first scanline
+            if scanline != scanline[:channels] * width:
+                return None
+            runs = [(width, scanline[:channels])]
+        else:
+            return None
+        for count, raw_color in runs:
+            raw_color_counts[raw_color] = raw_color_counts.get(raw_color, 0) + count
+    return raw_color_counts
+
+
+def get_sub_scanline_runs(scanline, width, channels, zero_scanline):
+    """Get the runs of equal pixels of a scanline with the Sub filter, whose only non-zero bytes start runs."""
+    if scanline[channels:] == zero_scanline[channels:]:  # Single color
+        return [(width, scanline[:channels])]
+    if len(scanline) - scanline.count(0) > MAX_SCANLINE_RUNS:
+        return None
+    run_starts = sorted({match.start() // channels for match in NON_ZERO_BYTE_PATTERN.finditer(scanline)} | {0})
+    runs, raw_color = [], bytes(channels)
+    for run_start, run_end in zip(run_starts, run_starts[1:] + [width]):
+        difference = scanline[run_start * channels:(run_start + 1) * channels]
+        raw_color = bytes((value + change) & 255 for value, change in zip(raw_color, difference))
+        runs.append((run_end - run_start, raw_color))
+    return runs
+
+
+def count_unfiltered_colors(raw_data, width, height, channels):
+    """Count the raw colors of scanlines with None, Sub or Up filters by unfiltering arrays, or None for other filters."""
+    rows = np.frombuffer(raw_data, dtype=np.uint8).reshape(height, width * channels + 1)
+    filter_types = rows[:, 0]
+    if np.any(filter_types > 2):  # Average and Paeth filters
+        return None
+
+    pixels = rows[:, 1:].reshape(height, width, channels).copy()
+    sub_rows = filter_types == 1
+    pixels[sub_rows] = np.cumsum(pixels[sub_rows], axis=1, dtype=np.uint8)
+    up_rows = filter_types == 2
+    if up_rows.any():  # Each row of a run of Up rows adds up to the last row before the run
+        run_starts = np.maximum.accumulate(np.where(up_rows, -1, np.arange(height)))
+        cumulated_pixels = np.cumsum(pixels, axis=0, dtype=np.uint8)
+        base_pixels = cumulated_pixels[np.maximum(run_starts - 1, 0)]
+        base_pixels[run_starts < 1] = 0
+        pixels = cumulated_pixels - base_pixels
+
+    padded_pixels = np.zeros((height * width, 4), dtype=np.uint8)
+    padded_pixels[:, :channels] = pixels.reshape(-1, channels)
+    packed_colors, counts = np.unique(padded_pixels.view(np.uint32).ravel(), return_counts=True)
+    return {color[:channels].tobytes(): int(count) for color, count in zip(unpack_colors(packed_colors), counts)}
+
+
+def get_rgba_color(raw_color, color_type, palette, transparency):
+    """Convert the raw bytes of a pixel to an RGBA color, or None for a palette index out of the palette."""
+    if color_type == 6:
+        return tuple(raw_color)
+    if color_type == 2:
+        return tuple(raw_color) + (255,)
+    if color_type in (0, 4):
+        return (raw_color[0],) * 3 + (raw_color[1] if color_type == 4 else 255,)
+    index = raw_color[0]
+    if 3 * index + 3 > len(palette):
+        return None
+    alpha = transparency[index] if transparency is not None and index < len(transparency) else 255
+    return tuple(palette[3 * index:3 * index + 3]) + (alpha,)
+
+
+def get_repaired_colors(colors_data, image_size):
+    """Merge minor colors into their closest remaining color until all colors are major."""
+    colors_data, repaired = sorted(colors_data, reverse=True), False
+    while len(colors_data) > 1 and colors_data[-1][0] / image_size <= 0.5 / len(colors_data):
+        pixel_count, color = colors_data.pop()
+        color_diffs = [sum(abs(a - b) for a, b in zip(color, major_color)) for _, major_color in colors_data]
+        closest_index = color_diffs.index(min(color_diffs))
+        colors_data[closest_index] = (colors_data[closest_index][0] + pixel_count, colors_data[closest_index][1])
+        colors_data.sort(reverse=True)
+        repaired = True
+    return colors_data, repaired
+
+
 def get_repaired_image(image):
     """Replace minor colors of an image by its major colors."""
     image = image.convert('RGBA')
-    allowed_conversion_count, repaired = len(image.getcolors()) - 1, False
-    while len(get_major_minor_colors(image)[1]) > 0 and allowed_conversion_count > 0:
-        image = image.convert('P', palette=Image.ADAPTIVE, colors=(len(image.getcolors()) - 1))
+    color_stats = get_color_stats(np.asarray(image))
+    allowed_conversion_count, repaired = len(color_stats['colors']) - 1, False
+    while not color_stats['is_major'].all() and allowed_conversion_count > 0:
+        image = image.convert('P', palette=Image.ADAPTIVE, colors=min(MAX_PALETTE_COLORS, len(color_stats['colors']) - 1))
         image = image.convert('RGBA')  # For convert to palette fix and final output
+        color_stats = get_color_stats(np.asarray(image))
         allowed_conversion_count -= 1
         repaired = True
     return image, repaired
 
 
-def get_major_minor_colors(image):
-    """Assign colors to major or minor color category."""
-    major_colors, minor_colors = [], []
-    image_size = image.size[0] * image.size[1]
-    colors_data = image.getcolors()
-    exp_color_ratio = 1 / len(colors_data)  # 1/n for n-colors image
-    for color_data in colors_data:
-        pixel_count, color = color_data
-        color_ratio = pixel_count / image_size
-        if color_ratio > 0.5 * exp_color_ratio:  # Major if more than half of exp ratio
-            major_colors.append(color)
-        else:
-            minor_colors.append(color)
-    return major_colors, minor_colors
+def get_color_stats(pixels):
+    """Count the colors of an RGBA image, or of a stack of same-sized RGBA images, in one vectorized pass."""
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    if pixels.ndim == 3:
+        pixels = pixels[np.newaxis]
+    image_count, image_size = len(pixels), pixels.shape[1] * pixels.shape[2]
+    sorted_pixels = np.sort(pixels.view(np.uint32).reshape(image_count, image_size), axis=1)
+    is_run_start = np.ones(sorted_pixels.shape, dtype=bool)  # Each run of equal pixels is a distinct color
+    is_run_start[:, 1:] = sorted_pixels[:, 1:] != sorted_pixels[:, :-1]
+    image_indexes, run_starts = np.nonzero(is_run_start)
+    counts = np.diff(np.append(image_indexes * image_size + run_starts, image_count * image_size))
+    color_counts = np.bincount(image_indexes, minlength=image_count)
+    ratios = counts / image_size
+    return {
+        'image_count': image_count,
+        'image_indexes': image_indexes,
+        'colors': sorted_pixels[image_indexes, run_starts],
+        'counts': counts,
+        'ratios': ratios,
+        'is_major': ratios > 0.5 / color_counts[image_indexes]  # Covering more than half of 1/n for n colors
+    }
+
+
+def unpack_colors(packed_colors):
+    """Unpack 32-bit colors into RGBA rows."""
+    return np.ascontiguousarray(packed_colors, dtype=np.uint32).view(np.uint8).reshape(-1, 4)
 
 
-def get_player_categories(player_image, category_palette):
-    """Identify the category of a player."""
+def get_color_categories(colors_data, category_palette):
+    """Identify the category of each color of a player's image."""
     player_categories = []
-    for _, player_color in player_image.getcolors():
+    for _, player_color in colors_data:
         closest_category, min_diff = None, float('inf')
         for category, category_color in category_palette.items():
             r_diff = abs(player_color[0] - category_color[0])
@@ -5,15 +5,21 @@
 import os
 import sys
 import csv
+import json
+import hashlib
 
 import image_utils
+import timing_utils
 import ui_utils
 
+CONFIG_FILE = '../../res/config.txt'
 ZLIST_FOLDER = '../../res/zlist'
 DATA_FOLDER = '../../data'
 CATEGORIES_FOLDER = '{data_folder}/categories'.format(data_folder=DATA_FOLDER)
 ZLIST_FILE = '{data_folder}/ZLIST.csv'.format(data_folder=DATA_FOLDER)
 CATEGORY_FILE_FORMAT = '{categories_folder}/%s.csv'.format(categories_folder=CATEGORIES_FOLDER)
+STATE_FOLDER = '{data_folder}/categorizer'.format(data_folder=DATA_FOLDER)  # Outside of data folders listed as data sets
+STATE_FILE = '{state_folder}/state.json'.format(state_folder=STATE_FOLDER)
 MAIN_CATEGORIES = ['ASSHOLE', 'CAMPER', 'GOLD', 'REROLL', 'TEAMKILL']
 
 
@@ -29,74 +35,121 @@ def load_player_ids():
     return player_ids
 
 
-def get_player_image_d(should_repair_images=False):
-    """Load the PNG file assigned to each player."""
-    player_image_d, repaired_image_file_name_d = {}, {}
-    file_names = os.listdir(ZLIST_FOLDER)
+def load_state(category_palette, use_complex_categories):
+    """Load the file states and category file hashes of the previous run, if made with the same settings."""
+    state = {}
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, 'r') as state_file:
+            state = json.load(state_file)
+    palette = {category: list(color) for category, color in category_palette.items()}
+    if state.get('palette') != palette or state.get('use_complex_categories') != use_complex_categories:
+        state = {}
+    return {
+        'palette': palette,
+        'use_complex_categories': use_complex_categories,
+        'files': state.get('files', {}),
+        'category_hashes': state.get('category_hashes', {})
+    }
+
+
+def save_state(state):
+    """Register the file states and category file hashes for the next run."""
+    ui_utils.prepare_folders(STATE_FOLDER)
+    with open(STATE_FILE + '.tmp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(STATE_FILE + '.tmp', STATE_FILE)
+
+
+def iter_player_categories(category_palette, should_repair_images=False, file_state_d=None):
+    """Load, repair and categorize the PNG file of each player, one file at a time, skipping unchanged files."""
+    file_state_d = file_state_d if file_state_d is not None else {}
+    file_names = [file_name for file_name in os.listdir(ZLIST_FOLDER) if file_name[0] != '.']
+    for file_name in set(file_state_d) - set(file_names):
+        del file_state_d[file_name]
+    repair_count, decode_count = 0, 0
     for index, file_name in enumerate(file_names):
-        if file_name[0] != '.':
-            player_name = file_name.rstrip('.png')
-            image, repaired = image_utils.get_player_image(ZLIST_FOLDER, file_name)
-            player_image_d[player_name] = image
-            if repaired:
-                repaired_image_file_name_d[file_name] = image
+        player_name = file_name.rstrip('.png')
+        file_path = os.path.join(ZLIST_FOLDER, file_name)
+        file_stat = os.stat(file_path)
+        file_state = file_state_d.get(file_name)
+        # Files of matching modification time and size are not decoded again, unless left unrepaired when repairing
+        is_unchanged = file_state and file_state['mtime'] == file_stat.st_mtime_ns and file_state['size'] == file_stat.st_size
+        if is_unchanged and not (should_repair_images and file_state.get('needs_repair', True)):
+            categories = file_state['categories']
+        else:
+            with timing_utils.stage('image decode', 1):
+                colors_data, repaired = image_utils.get_player_colors(ZLIST_FOLDER, file_name)
+            if repaired and should_repair_images:
+                with timing_utils.stage('image save', 1):
+                    image, _ = image_utils.get_player_image(ZLIST_FOLDER, file_name)
+                    save_image(image, file_path)
+                file_stat = os.stat(file_path)
+                repair_count += 1
+            with timing_utils.stage('categorization', 1):
+                categories = image_utils.get_color_categories(colors_data, category_palette)
+            file_state_d[file_name] = {
+                'mtime': file_stat.st_mtime_ns,
+                'size': file_stat.st_size,
+                'categories': categories,
+                'needs_repair': repaired and not should_repair_images
+            }
+            decode_count += 1
         progress = (index + 1) / len(file_names) * 100
-        sys.stdout.write("\rLoading and repairing image files: %.2f %%" % progress)
+        sys.stdout.write("\rLoading, repairing and categorizing image files: %.2f %%" % progress)
         sys.stdout.flush()
+        yield player_name, categories
     print()
+    print("Decoded %d new or modified image files out of %d." % (decode_count, len(file_names)))
+    if should_repair_images:
+        print("Registered %d repaired image files." % repair_count)
+
+
+def save_image(image, file_path):
+    """Replace an image file without leaving it truncated if interrupted."""
+    temp_file_path = os.path.join(os.path.dirname(file_path), '.%s.tmp' % os.path.basename(file_path))
+    image.save(temp_file_path, format='PNG')
+    os.replace(temp_file_path, file_path)
+
+
+def register_player_categories(player_categories, player_ids, use_complex_categories=False, category_hashes=None):
+    """Register player categories to CSV files as they are identified, then sort the files by player name."""
+    category_hashes = category_hashes if category_hashes is not None else {}
+    category_files, category_writers = {}, {}
+    try:
+        for player_name, categories in player_categories:
+            if use_complex_categories:  # Register players in exact complex category CSV files
+                categories = ['_'.join(sorted(categories))]
+            for category in categories:  # Otherwise register players in main category CSV files only
+                if category not in category_writers:
+                    category_files[category] = open(CATEGORY_FILE_FORMAT % category + '.tmp', 'w', newline='')
+                    category_writers[category] = csv.writer(category_files[category], delimiter=',')
+                if player_name in player_ids:
+                    category_writers[category].writerow([player_name, player_ids[player_name]])
+    finally:
+        for category_file in category_files.values():
+            category_file.close()
 
-    index, repair_count = 0, len(repaired_image_file_name_d)
-    if should_repair_images and repair_count > 0:
-        for file_name, image in repaired_image_file_name_d.items():
-            image.save(os.path.join(ZLIST_FOLDER, file_name))
-            progress = (index + 1) / repair_count * 100
-            sys.stdout.write("\rRegistering repaired image files: %.2f %%" % progress)
-            sys.stdout.flush()
-            index += 1
-        print()
-    return player_image_d
-
-
-def get_player_categories_d(player_image_d, category_palette):
-    """Identify the categories of players."""
-    player_categories_d = {}
-    index, player_count = 0, len(player_image_d)
-    for player_name, player_image in player_image_d.items():
-        categories = image_utils.get_player_categories(player_image, category_palette)
-        player_categories_d[player_name] = categories
-        progress = (index + 1) / player_count * 100
-        sys.stdout.write("\rIdentifying player categories: %.2f %%" % progress)
-        sys.stdout.flush()
-        index += 1
-    print()
-    return player_categories_d
-
-
-def register_player_categories(player_categories_d, player_ids, use_complex_categories=False):
-    """Register identified player categories to CSV file."""
     print("Registering player categories to CSV file... ", end='', flush=True)
-    categories_d = {}
-    if not use_complex_categories:  # Register players in main category CSV files only
-        for player_name, player_categories in player_categories_d.items():
-            for player_category in player_categories:
-                if player_category not in categories_d:
-                    categories_d[player_category] = []
-                categories_d[player_category].append(player_name)
-    else:  # Register players in exact complex category CSV files
-        for player_name, player_categories in player_categories_d.items():
-            complex_player_category = '_'.join(sorted(player_categories))
-            if complex_player_category not in categories_d:
-                categories_d[complex_player_category] = []
-            categories_d[complex_player_category].append(player_name)
-
-    for category, player_names in categories_d.items():
+    updated_categories = []
+    for category in category_files:
         category_file_path = CATEGORY_FILE_FORMAT % category
-        with open(category_file_path, 'w', newline='') as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=',')
-            for player_name in sorted(player_names, key=str.lower):
-                if player_name in player_ids:
-                    csv_writer.writerow([player_name, player_ids[player_name]])
-    print("Done.")
+        with open(category_file_path + '.tmp', 'r', newline='') as csv_file:
+            rows = sorted(csv.reader(csv_file, delimiter=','), key=lambda row: row[0].lower())
+        rows_hash = hashlib.sha1(json.dumps(rows).encode()).hexdigest()  # Files of unchanged content are left untouched
+        if category_hashes.get(category) == rows_hash and os.path.exists(category_file_path):
+            os.remove(category_file_path + '.tmp')
+            continue
+        with open(category_file_path + '.tmp', 'w', newline='') as csv_file:
+            csv.writer(csv_file, delimiter=',').writerows(rows)
+        os.replace(category_file_path + '.tmp', category_file_path)
+        category_hashes[category] = rows_hash
+        updated_categories.append(category)
+    for category in set(category_hashes) - set(category_files):  # Categories no longer assigned
+        if os.path.exists(CATEGORY_FILE_FORMAT % category):
+            os.remove(CATEGORY_FILE_FORMAT % category)
+        del category_hashes[category]
+        updated_categories.append(category)
+    print("Done. Updated %d category files out of %d." % (len(updated_categories), len(category_files)))
 
 
 if __name__ == '__main__':
@@ -114,12 +167,19 @@ if __name__ == '__main__':
           "You will also be asked to choose between sorting players according to "
           "their main category (if a player has more than one category, he will "
           "be listed in more than one file) or sorting them according to their "
-          "composite category (combinaison of the main categories of the player).\n\n"
+          "composite category (combinaison of the main categories of the player).\n"
+          "Unless asked to categorize all image files, only the image files "
+          "modified since the previous run are decoded again and only the "
+          "category files whose content changed are rewritten.\n\n"
           "Press ENTER to continue (or CTRL + C + ENTER to abort).\n")
 
+    timing_utils.enable_report(CONFIG_FILE)
     ui_utils.prepare_files(DATA_FOLDER, ZLIST_FILE)
-    ui_utils.prepare_folders(CATEGORIES_FOLDER, clean=True)
 
+    use_previous_run = ui_utils.select_update_option(
+        ('update from modified image files only', True),
+        ('categorize all image files', False)
+    )
     should_repair_images = ui_utils.select_repair_option(
         ('save repaired images', True),
         ('do nothing', False)
@@ -131,6 +191,10 @@ if __name__ == '__main__':
 
     player_ids = load_player_ids()
     category_palette = image_utils.get_category_palette(ZLIST_FOLDER, MAIN_CATEGORIES)
-    player_image_d = get_player_image_d(should_repair_images)
-    player_categories_d = get_player_categories_d(player_image_d, category_palette)
-    register_player_categories(player_categories_d, player_ids, use_complex_categories)
+    state = load_state(category_palette, use_complex_categories)
+    if not use_previous_run or not state['files']:
+        ui_utils.prepare_folders(CATEGORIES_FOLDER, clean=True)
+        state['files'], state['category_hashes'] = {}, {}
+    player_categories = iter_player_categories(category_palette, should_repair_images, state['files'])
+    register_player_categories(player_categories, player_ids, use_complex_categories, state['category_hashes'])
+    save_state(state)
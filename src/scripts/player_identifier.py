@@ -6,13 +6,12 @@ import os
 import sys
 import csv
 
-import requests
-
+import api_utils
+import timing_utils
 import ui_utils
 
 CONFIG_FILE = '../../res/config.txt'
 APP_ID = 'demo'
-ACCOUNT_INFO_REQUEST_URL = 'https://api.worldoftanks.eu/wot/account/list/'
 BATCH_SIZE = 100
 ZLIST_FOLDER = '../../res/zlist'
 DATA_FOLDER = '../../data'
@@ -73,8 +72,7 @@ def fetch_player_ids(player_names):
         'search': ','.join(player_names),
         'type': 'exact'
     }
-    response = requests.get(ACCOUNT_INFO_REQUEST_URL, params=payload)
-    response_content = response.json()
+    response_content = api_utils.request('account/list', payload)
 
     player_ids = {player: UNKNOWN_ID for player in player_names}
     if response_content['status'] == 'ok':
@@ -110,6 +108,8 @@ if __name__ == '__main__':
           "Press ENTER to continue (or CTRL + C + ENTER to abort).\n")
 
     APP_ID = ui_utils.load_app_id(CONFIG_FILE, APP_ID)
+    api_utils.load_api_urls(CONFIG_FILE)
+    timing_utils.enable_report(CONFIG_FILE)
     ui_utils.prepare_folders(ZLIST_FOLDER)
     ui_utils.prepare_files(DATA_FOLDER, CSV_FILE)
 
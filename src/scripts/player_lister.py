@@ -6,16 +6,25 @@ import sys
 import random
 import csv
 
-import requests
+import numpy as np
 
+import api_utils
+import expression_utils
+import stat_enum
+import store_utils
+import summary_utils
+import timing_utils
 import ui_utils
 
 CONFIG_FILE = '../../res/config.txt'
 APP_ID = 'demo'
-ACCOUNT_INFO_REQUEST_URL = "https://api.worldoftanks.eu/wot/account/info/"
 BATCH_SIZE = 100
 DATA_FOLDER = "../../data"
 CSV_FILE = '{data_folder}/SERVER.csv'.format(data_folder=DATA_FOLDER)
+SCANS_FOLDER = '{data_folder}/scans'.format(data_folder=DATA_FOLDER)  # Outside of data folders listed as data sets
+SCAN_SUMMARY_FILE_FORMAT = '{scans_folder}/%s.npz'.format(scans_folder=SCANS_FOLDER)
+SCAN_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+STORE_FILE = store_utils.STORE_FILE_FORMAT % 'SERVER'
 ID_LOWER_BOUND = 500000000
 ID_UPPER_BOUND = 560000000
 
@@ -33,7 +42,7 @@ def load_account_id_d():
     return account_id_d
 
 
-def list_accounts(account_id_d, step, use_random_offset=True, filters=[]):
+def list_accounts(account_id_d, step, use_random_offset=True, filters=[], summaries=None, stores=None):
     """List a fraction of all existing accounts ids in provided range."""
     loaded_account_id_amount, filtered_account_amount = len(account_id_d), 0
     offset = random.randint(0, step) if use_random_offset else 0
@@ -47,7 +56,8 @@ def list_accounts(account_id_d, step, use_random_offset=True, filters=[]):
                 account_id = min(account_id + step, ID_UPPER_BOUND)
             else:
                 account_id += 1
-        filtered_account_amount += test_accounts(account_id_d, batch, filters)
+        with timing_utils.stage('account listing', len(batch)):
+            filtered_account_amount += test_accounts(account_id_d, batch, filters, summaries, stores)
         progress = (account_id - ID_LOWER_BOUND) / (ID_UPPER_BOUND - ID_LOWER_BOUND + 1) * 100
         sys.stdout.write("\rTesting account ids : %.2f %%" % progress)
         sys.stdout.flush()
@@ -56,31 +66,51 @@ def list_accounts(account_id_d, step, use_random_offset=True, filters=[]):
     ))
 
 
-def test_accounts(account_id_d, batch, filters=[]):
-    """Test if account ids in given batch are registered."""
+def test_accounts(account_id_d, batch, filters=[], summaries=None, stores=None):
+    """Test if account ids in given batch are registered, summarizing the stats of accounts and storing them if requested."""
+    summaries = summaries or {}
+    store_fields = get_store_fields() if stores is not None else []
     filter_fields = [_filter['field'] for _filter in filters]
     filter_dependencies = [_filter['dependency'] for _filter in filters]
+    compiled_expressions = {stat_id: expression_utils.compile_expression(SCAN_STATS[stat_id]['expression']) for stat_id in summaries}
+    summary_fields = [field for compiled_expression in compiled_expressions.values() for field in compiled_expression['fields']]
     payload = {
         'application_id': APP_ID,
         'account_id': ','.join(batch),
-        'fields': ','.join(['nickname', 'account_id'] + filter_fields + filter_dependencies)
+        'fields': ','.join(['nickname', 'account_id'] + filter_fields + filter_dependencies + summary_fields + store_fields)
     }
-    response = requests.get(ACCOUNT_INFO_REQUEST_URL, params=payload)
-    response_content = response.json()
+    response_content = api_utils.request('account/info', payload)
 
-    filtered_account_amount = 0
+    filtered_account_amount, registered_player_ids = 0, []
     if response_content['status'] == 'ok':
-        for player_id in response_content['data']:
-            account_data = response_content['data'][player_id]
-            if account_data:
-                if all(test_filter(account_data, _filter) for _filter in filters):
-                    player_name = account_data['nickname']
-                    account_id_d[player_id] = player_name
-                else:
-                    filtered_account_amount += 1
+        with timing_utils.stage('account filtering', len(batch)):
+            for player_id in response_content['data']:
+                account_data = response_content['data'][player_id]
+                if account_data:
+                    if all(test_filter(account_data, _filter) for _filter in filters):
+                        player_name = account_data['nickname']
+                        account_id_d[player_id] = player_name
+                        registered_player_ids.append(player_id)
+                    else:
+                        filtered_account_amount += 1
+        if compiled_expressions:
+            with timing_utils.stage('scan summaries', len(batch)):
+                accounts_data = [account_data for account_data in response_content['data'].values() if account_data]
+                for stat_id, compiled_expression in compiled_expressions.items():
+                    stats = expression_utils.evaluate_expression(compiled_expression, accounts_data)
+                    summary_utils.update_summary(summaries[stat_id], stats[~np.isnan(stats)])
+        if stores is not None:
+            with timing_utils.stage('account storing', len(registered_player_ids)):
+                players_data = [response_content['data'][player_id] for player_id in registered_player_ids]
+                stores.append(store_utils.build_store(store_fields, registered_player_ids, players_data))
     return filtered_account_amount
 
 
+def get_store_fields():
+    """Get the fields of all the stats of the player_profiler that can be computed from account info."""
+    return store_utils.get_store_fields([stat_type['expression'] for stat_type in stat_enum.STATS.values() if 'expression' in stat_type])
+
+
 def test_filter(account_data, _filter):
     """Test if the account respects the filter."""
     stat = account_data
@@ -98,6 +128,35 @@ def test_filter(account_data, _filter):
     return valid
 
 
+def build_scan_summaries():
+    """Build empty summaries of the stats of scanned accounts."""
+    return {stat_id: summary_utils.build_summary([], scan_stat['bin_width']) for stat_id, scan_stat in SCAN_STATS.items()}
+
+
+def register_scan_summaries(summaries):
+    """Register the summaries of the stats of scanned accounts and print their quantiles."""
+    ui_utils.prepare_folders(SCANS_FOLDER)
+    for stat_id, summary in summaries.items():
+        summary_utils.save_summary(summary, SCAN_SUMMARY_FILE_FORMAT % stat_id)
+    print("Distribution of the stats of scanned accounts:")
+    print("  {:<18}{:>10}".format("stat", "accounts") + ''.join("{:>12}".format("p%d" % (quantile * 100)) for quantile in SCAN_QUANTILES))
+    for stat_id, summary in summaries.items():
+        print("  {:<18}{:>10}".format(SCAN_STATS[stat_id]['name'], summary['count']) + ''.join(
+            "{:>12.2f}".format(summary_utils.get_quantile(summary, quantile)) for quantile in SCAN_QUANTILES
+        ))
+
+
+def register_store(stores):
+    """Register the stats of listed accounts in the store, along with those of previously listed accounts."""
+    print("Registering account stats to store... ", end='', flush=True)
+    previous_store = store_utils.load_store(STORE_FILE)
+    current_store = store_utils.build_store(get_store_fields())  # Last, so that stores of outdated fields are discarded
+    store = store_utils.merge_stores(([previous_store] if previous_store else []) + stores + [current_store])
+    ui_utils.prepare_folders(store_utils.STORES_FOLDER)
+    store_utils.save_store(store, STORE_FILE)
+    print("Done. Stored the stats of {count} accounts.".format(count=len(store['player_ids'])))
+
+
 def register_accounts(account_id_d):
     """Register existing accounts in CSV file."""
     print("Registering account ids to CSV file... ", end='', flush=True)
@@ -135,6 +194,24 @@ AVAILABLE_FILTERS = [
     }
 ]
 
+SCAN_STATS = {
+    'battles': {
+        'expression': 'statistics.all.battles',
+        'name': "battle count",
+        'bin_width': 10
+    },
+    'wr': {
+        'expression': 'statistics.all.wins / statistics.all.battles * 100',
+        'name': "win ratio (%)",
+        'bin_width': 0.05
+    },
+    'global_rating': {
+        'expression': 'global_rating',
+        'name': "global rating",
+        'bin_width': 5
+    }
+}
+
 
 if __name__ == '__main__':
     input("The module player_lister connects to the WG API to retrieve the "
@@ -150,6 +227,8 @@ if __name__ == '__main__':
           "Press ENTER to continue (or CTRL + C + ENTER to abort).\n")
 
     APP_ID = ui_utils.load_app_id(CONFIG_FILE, APP_ID)
+    api_utils.load_api_urls(CONFIG_FILE)
+    timing_utils.enable_report(CONFIG_FILE)
     ui_utils.prepare_files(DATA_FOLDER, CSV_FILE)
 
     step = int(1 / ui_utils.select_search_mode(
@@ -164,7 +243,15 @@ if __name__ == '__main__':
         ('random', True)
     )
     filters = ui_utils.select_filters(AVAILABLE_FILTERS)
+    stores = ui_utils.select_store_option(
+        ('store stats', []),
+        ('do nothing', None)
+    )
 
     account_id_d = load_account_id_d()
-    list_accounts(account_id_d, step, use_random_offset, filters)
+    summaries = build_scan_summaries()
+    list_accounts(account_id_d, step, use_random_offset, filters, summaries, stores)
     register_accounts(account_id_d)
+    register_scan_summaries(summaries)
+    if stores is not None:
+        register_store(stores)
@@ -2,8 +2,10 @@
 
 """Add players listed by the Gold Logger mod to the ZList."""
 
+import io
 import os
 import csv
+from concurrent.futures import ThreadPoolExecutor
 
 import image_utils
 import ui_utils
@@ -13,6 +15,8 @@ GOLD_USER_FILE = '{folder}/GOLD_USER.csv'.format(folder=GAME_FOLDER)
 ZLIST_FOLDER = '{folder}/res_mods/mods/shared_resources/xvm/res/clanicons/EU/nick'.format(folder=GAME_FOLDER)
 MAIN_CATEGORIES = ['ASSHOLE', 'CAMPER', 'GOLD', 'REROLL', 'TEAMKILL']
 MANDATORY_CATEGORY = 'GOLD'
+LINK_PLAYER_FILES = False  # Hardlink player files to category files instead of copying them, where supported
+WRITE_WORKERS = 8
 
 
 def load_logged_players():
@@ -21,7 +25,7 @@ def load_logged_players():
     player_ids = {}
     with open(GOLD_USER_FILE, 'r', newline='') as csv_file:
         csv_reader = csv.reader(csv_file, delimiter=',')
-        for player_name, player_id in csv_reader:
+        for player_name, player_id, *_ in csv_reader:  # Optionally followed by arena id and shell type
             player_ids[player_name] = player_id
     print("Done.")
     return player_ids
@@ -44,12 +48,23 @@ def get_player_files(logged_players, category_palette):
         category_code_file_path = os.path.join(ZLIST_FOLDER, category_code_file_name)
         player_files[player_name] = (player_file_name, category_code_file_name)
         if category_code_file_name not in category_code_files and os.path.isfile(category_code_file_path):
-            category_code_file, _ = image_utils.get_player_image(ZLIST_FOLDER, category_code_file_name)
-            category_code_files[category_code_file_name] = category_code_file
+            category_code_files[category_code_file_name] = get_category_code_file(category_code_file_name)
     print("Done.")
     return player_files, category_code_files
 
 
+def get_category_code_file(category_code_file_name):
+    """Get the content of a category file, repaired if needed, and whether it can be linked as is."""
+    category_code_file_path = os.path.join(ZLIST_FOLDER, category_code_file_name)
+    image, repaired = image_utils.get_player_image(ZLIST_FOLDER, category_code_file_name)
+    if repaired:  # Encoded once to be copied as many times as needed
+        image_bytes = io.BytesIO()
+        image.save(image_bytes, format='PNG')
+        return image_bytes.getvalue(), False
+    with open(category_code_file_path, 'rb') as image_file:
+        return image_file.read(), True
+
+
 def get_player_file_name(player_file_name, player_file_names):
     """Return the name of the file of the player in the same case as in the list."""
     for file_name in player_file_names:
@@ -62,8 +77,8 @@ def get_category_code(player_file_name, player_file_names, category_palette):
     """Get the concatened string of player's categories."""
     categories = []
     if player_file_name in player_file_names:
-        image, _ = image_utils.get_player_image(ZLIST_FOLDER, player_file_name)
-        categories += image_utils.get_player_categories(image, category_palette)
+        colors_data, _ = image_utils.get_player_colors(ZLIST_FOLDER, player_file_name)
+        categories += image_utils.get_color_categories(colors_data, category_palette)
     if MANDATORY_CATEGORY not in categories:
         categories.append(MANDATORY_CATEGORY)
     category_code = ''.join(sorted(categories))
@@ -73,17 +88,17 @@ def get_category_code(player_file_name, player_file_names, category_palette):
 def register_player_files(player_files, category_code_files):
     """Register player files in the ZList."""
     print("Registering player files in the ZList... ", end='', flush=True)
-    unprocessed_player_names, missing_category_code_files = [], []
+    unprocessed_player_names, missing_category_code_files, write_jobs = [], [], []
     for player_name in player_files:
         player_file_name, category_code_file_name = player_files[player_name]
         if category_code_file_name in category_code_files:
-            player_file_path = os.path.join(ZLIST_FOLDER, player_file_name)
-            category_code_file = category_code_files[category_code_file_name]
-            category_code_file.save(player_file_path)
+            write_jobs.append((player_file_name, category_code_file_name))
         else:
             unprocessed_player_names.append(player_name)
             if category_code_file_name not in missing_category_code_files:
                 missing_category_code_files.append(category_code_file_name)
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        list(executor.map(lambda write_job: write_player_file(*write_job, category_code_files), write_jobs))
     if not unprocessed_player_names:
         print("Done. Logged {passing} players.".format(passing=(len(player_files))))
     else:
@@ -95,6 +110,25 @@ def register_player_files(player_files, category_code_files):
     return unprocessed_player_names
 
 
+def write_player_file(player_file_name, category_code_file_name, category_code_files):
+    """Replace the file of a player by a copy of a category file, without leaving it truncated if interrupted."""
+    player_file_path = os.path.join(ZLIST_FOLDER, player_file_name)
+    temp_file_path = os.path.join(ZLIST_FOLDER, '.%s.tmp' % player_file_name)
+    category_code_file, can_be_linked = category_code_files[category_code_file_name]
+    if os.path.exists(temp_file_path):
+        os.remove(temp_file_path)
+    if LINK_PLAYER_FILES and can_be_linked:
+        try:
+            os.link(os.path.join(ZLIST_FOLDER, category_code_file_name), temp_file_path)
+            os.replace(temp_file_path, player_file_path)
+            return
+        except OSError:  # Not supported by the file system
+            pass
+    with open(temp_file_path, 'wb') as player_file:
+        player_file.write(category_code_file)
+    os.replace(temp_file_path, player_file_path)
+
+
 def clear_log_file(logged_players, unprocessed_player_names):
     """Clear the log file and eventually leaves unprocessed players."""
     print("Clearing added players from log file... ", end='', flush=True)
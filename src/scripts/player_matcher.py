@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Find accounts of the server sample whose profile is closest to the players of a category."""
+
+import os
+import sys
+import csv
+import time
+import hashlib
+import argparse
+
+import numpy as np
+
+import api_utils
+import stat_enum
+import player_profiler as profiler
+import player_ranker as ranker
+import timing_utils
+import ui_utils
+import wn8_utils
+
+CONFIG_FILE = '../../res/config.txt'
+DATA_FOLDER = '../../data'
+CATEGORIES_FOLDER = '{data_folder}/categories'.format(data_folder=DATA_FOLDER)
+SERVER_FILE = ranker.SERVER_FILE
+INDEX_FOLDER = '{data_folder}/matcher'.format(data_folder=DATA_FOLDER)  # Outside of data folders listed as data sets
+INDEX_FILE = '{index_folder}/index.npz'.format(index_folder=INDEX_FOLDER)
+CANDIDATES_FILE_FORMAT = '{data_folder}/%s_CANDIDATES.csv'.format(data_folder=DATA_FOLDER)
+INDEX_MAX_AGE = 7 * 24 * 3600
+FEATURE_STATS = ['battles', 'wn8', 'wr', 'avg_damage', 'hit_ratio', 'created_at']
+LOG_SCALED_STATS = ['battles']  # Heavy-tailed stats compared by order of magnitude
+REFERENCE_CATEGORY = 'REROLL'
+CANDIDATE_COUNT = 100
+BLOCK_SIZE = 4096  # Accounts compared to all references at once
+
+
+def get_features(player_ids):
+    """Get the feature stats of players as a float64 matrix, NaN where missing."""
+    stat_types = [stat_enum.STATS[stat_id] for stat_id in FEATURE_STATS]
+    exp_values_d = wn8_utils.get_exp_values_d() if any(stat_type['use_exp_values'] for stat_type in stat_types) else None
+    profiler.prefetch_stats([player_ids], stat_types, exp_values_d)
+    return np.column_stack([
+        profiler.get_stats(stat_type, None, player_ids, exp_values_d if stat_type['use_exp_values'] else None)
+        for stat_type in stat_types
+    ])
+
+
+def load_index(server_player_ids, should_rebuild=False):
+    """Load the features of the accounts of the server sample, building and registering them if missing or outdated."""
+    sample_key = hashlib.sha1(np.sort(server_player_ids).tobytes()).hexdigest()
+    if not should_rebuild and os.path.exists(INDEX_FILE):
+        with np.load(INDEX_FILE) as index_file:
+            if (index_file['sample_key'].item() == sample_key and list(index_file['stats']) == FEATURE_STATS
+                    and time.time() - index_file['timestamp'].item() <= INDEX_MAX_AGE):
+                return index_file['player_ids'], index_file['features']
+
+    print("Indexing the features of {count} players of the server sample.".format(count=len(server_player_ids)))
+    features = get_features(server_player_ids)
+    is_complete = ~np.isnan(features).any(axis=1)
+    player_ids, features = server_player_ids[is_complete], features[is_complete]
+    ui_utils.prepare_folders(INDEX_FOLDER)
+    np.savez(INDEX_FILE, player_ids=player_ids, features=features, stats=FEATURE_STATS, sample_key=sample_key, timestamp=int(time.time()))
+    return player_ids, features
+
+
+def normalize_features(features, index_features):
+    """Scale features so that each stat of the index has a zero mean and a unit variance."""
+    log_scaled = np.isin(FEATURE_STATS, LOG_SCALED_STATS)
+    features, index_features = features.astype(np.float64), index_features.astype(np.float64)
+    features[:, log_scaled] = np.log1p(np.maximum(features[:, log_scaled], 0))
+    index_features[:, log_scaled] = np.log1p(np.maximum(index_features[:, log_scaled], 0))
+    means, stds = index_features.mean(axis=0), index_features.std(axis=0)
+    return ((features - means) / np.where(stds > 0, stds, 1)).astype(np.float32)
+
+
+def get_nearest_distances(features, reference_features):
+    """Get the distance of each account to its nearest reference, comparing blocks of accounts to all references at once."""
+    distances = np.empty(len(features), dtype=np.float32)
+    reference_norms = (reference_features ** 2).sum(axis=1)
+    for start in range(0, len(features), BLOCK_SIZE):
+        block = features[start:start + BLOCK_SIZE]
+        squared_distances = (block ** 2).sum(axis=1)[:, np.newaxis] + reference_norms - 2 * block @ reference_features.T
+        distances[start:start + BLOCK_SIZE] = np.sqrt(np.maximum(squared_distances.min(axis=1), 0))
+    return distances
+
+
+def find_candidates(reference_player_ids, server_player_ids, candidate_count, should_rebuild=False):
+    """Find the accounts of the server sample closest to any reference player, closest first, with their distance and features."""
+    index_player_ids, index_features = load_index(server_player_ids, should_rebuild)
+    reference_features = get_features(reference_player_ids)
+    reference_features = reference_features[~np.isnan(reference_features).any(axis=1)]
+    if len(reference_features) == 0 or len(index_features) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros((0, len(FEATURE_STATS)))
+    with timing_utils.stage('similarity search', len(index_features)):
+        distances = get_nearest_distances(
+            normalize_features(index_features, index_features), normalize_features(reference_features, index_features)
+        )
+        distances[np.isin(index_player_ids, reference_player_ids)] = np.inf  # Already registered
+        candidate_count = min(candidate_count, int(np.isfinite(distances).sum()))
+        candidate_rows = np.argpartition(distances, candidate_count - 1)[:candidate_count] if candidate_count > 0 else np.zeros(0, dtype=np.int64)
+        candidate_rows = candidate_rows[np.argsort(distances[candidate_rows], kind='stable')]
+    return index_player_ids[candidate_rows], distances[candidate_rows], index_features[candidate_rows]
+
+
+def register_candidates(candidates_file_path, candidate_player_ids, player_names):
+    """Register candidates in CSV file, closest first, in the format of data files."""
+    print("Registering candidates to CSV file... ", end='', flush=True)
+    with open(candidates_file_path, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',')
+        for player_id in candidate_player_ids.tolist():
+            csv_writer.writerow([player_names.get(player_id, ''), player_id])
+    print("Done.")
+
+
+def print_candidates(candidate_player_ids, distances, features, player_names, displayed_count=20):
+    """Print the closest candidates along with their feature stats."""
+    stat_names = [stat_enum.STATS[stat_id]['short_name'] for stat_id in FEATURE_STATS]
+    print("Closest candidates:")
+    print("  {:<26}{:>10}".format("player", "distance") + ''.join("{:>16}".format(stat_name) for stat_name in stat_names))
+    for player_id, distance, player_features in zip(candidate_player_ids[:displayed_count].tolist(), distances, features):
+        print("  {:<26}{:>10.3f}".format(player_names.get(player_id, str(player_id)), distance) + ''.join(
+            "{:>16.0f}".format(stat) if stat_id == 'created_at' or abs(stat) >= 1000 else "{:>16.2f}".format(stat)
+            for stat_id, stat in zip(FEATURE_STATS, player_features)
+        ))
+
+
+def run_matching(reference_name, reference_files, candidate_count, should_rebuild=False):
+    """Find and register the accounts of the server sample closest to the reference players."""
+    server_player_ids, reference_player_ids = profiler.load_player_ids_sets([[SERVER_FILE], reference_files])
+    candidate_player_ids, distances, features = find_candidates(reference_player_ids, server_player_ids, candidate_count, should_rebuild)
+    player_names = ranker.load_player_names([[SERVER_FILE]])
+    print_candidates(candidate_player_ids, distances, features, player_names)
+    candidates_file_path = CANDIDATES_FILE_FORMAT % reference_name
+    register_candidates(candidates_file_path, candidate_player_ids, player_names)
+    print("  {file}".format(file=os.path.abspath(candidates_file_path)))
+
+
+def parse_arguments():
+    """Parse the command line arguments of the batch mode."""
+    argument_parser = argparse.ArgumentParser(description="Find accounts of the server sample closest to the players of a category.")
+    argument_parser.add_argument('--set', default=REFERENCE_CATEGORY, help="comma-separated data files of the reference players")
+    argument_parser.add_argument('--count', type=int, default=CANDIDATE_COUNT, help="number of candidates")
+    argument_parser.add_argument('--rebuild', action='store_true', help="rebuild the index of the server sample even if up to date")
+    arguments = argument_parser.parse_args()
+
+    data_options = dict(ui_utils.list_data_options(CATEGORIES_FOLDER, DATA_FOLDER))
+    reference_names = arguments.set.split(',')
+    for name in reference_names:
+        if name not in data_options:
+            argument_parser.error("unknown data file: {name}".format(name=name))
+    return '+'.join(reference_names), [data_options[name] for name in reference_names], max(1, arguments.count), arguments.rebuild
+
+
+if __name__ == '__main__':
+    ui_utils.prepare_folders(DATA_FOLDER, CATEGORIES_FOLDER)
+    if not os.path.exists(SERVER_FILE):
+        print("The server sample {file} is missing, run the player_lister first.".format(file=os.path.abspath(SERVER_FILE)))
+        sys.exit()
+
+    if len(sys.argv) > 1:  # Batch mode
+        reference_name, reference_files, candidate_count, should_rebuild = parse_arguments()
+        profiler.APP_ID = ui_utils.load_app_id(CONFIG_FILE, profiler.APP_ID)
+        api_utils.load_api_urls(CONFIG_FILE)
+        timing_utils.enable_report(CONFIG_FILE)
+        run_matching(reference_name, reference_files, candidate_count, should_rebuild)
+        sys.exit()
+
+    input("The module player_matcher looks for accounts of the server sample "
+          "registered by the player_lister whose profile (battles, WN8, WR, "
+          "average damage, hit ratio and creation time) is the closest to that "
+          "of the selected reference players, e.g. those of the REROLL category.\n"
+          "The profiles of the server sample are registered once and reused "
+          "until the sample changes. The closest accounts are registered in a "
+          "CSV file which can in turn be used as a data set.\n\n"
+          "Press ENTER to continue (or CTRL + C + ENTER to abort).\n")
+
+    profiler.APP_ID = ui_utils.load_app_id(CONFIG_FILE, profiler.APP_ID)
+    api_utils.load_api_urls(CONFIG_FILE)
+    timing_utils.enable_report(CONFIG_FILE)
+
+    data_options = ui_utils.select_data_files(0, CATEGORIES_FOLDER, DATA_FOLDER)
+    run_matching('+'.join(name for name, _ in data_options), [file for _, file in data_options], CANDIDATE_COUNT)
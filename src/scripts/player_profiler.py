@@ -2,26 +2,44 @@
 
 """Generate graphs of player stats."""
 
+import os
 import sys
 import math
 import csv
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
-import requests
 
+import api_utils
+import expression_utils
 import stat_enum
+import store_utils
+import summary_utils
+import table_utils
+import timing_utils
 import ui_utils
 import wn8_utils
 
 CONFIG_FILE = '../../res/config.txt'
 APP_ID = 'demo'
-ACCOUNT_INFO_REQUEST_URL = 'https://api.worldoftanks.eu/wot/account/info/'
 BATCH_SIZE = 100
+FETCH_WORKERS = 4  # Number of batches of players fetched concurrently
 DATA_FOLDER = '../../data'
 CATEGORIES_FOLDER = '{data_folder}/categories'.format(data_folder=DATA_FOLDER)
 CATEGORY_FILE_FORMAT = '{categories_folder}/%s.csv'.format(categories_folder=CATEGORIES_FOLDER)
+PLOTS_FOLDER = '{data_folder}/plots'.format(data_folder=DATA_FOLDER)
+SUMMARIES_FOLDER = '{data_folder}/summaries'.format(data_folder=DATA_FOLDER)
+SUMMARY_FILE_FORMAT = '{summaries_folder}/%s.npz'.format(summaries_folder=SUMMARIES_FOLDER)
+SUMMARY_BINS_PER_MARK = 120  # Resolution of histogram summaries, divisible by most bin per mark ratios
+SUMMARY_MAX_AGE = 24 * 3600
+STORE_FILE = store_utils.STORE_FILE_FORMAT % 'SERVER'  # Stats registered by the player_lister
+STORE_MAX_AGE = 24 * 3600
+PLOT_FILE_FORMAT = '{plots_folder}/%s.png'.format(plots_folder=PLOTS_FOLDER)
 UNKNOWN_ID = -1
 COLORS = [
     (.93, .11, .14, .75),  # Red
@@ -32,43 +50,49 @@ COLORS = [
     (.11, .47, .71, .75)   # Blue
 ]
 COLORS = []  # Comment out to use predefined colors
+CURVE_STATISTIC = 'mean'  # 'mean' or 'median' of y-axis stats in each bin
+CURVE_BAND = None  # None, 'percentiles' (CURVE_BAND_PERCENTILES) or 'confidence' (95 % of the mean)
+CURVE_BAND_PERCENTILES = (25, 75)
 WR_REFERENCES = [47, 49, 53, 58, 64]
 WN8_REFERENCES = [452, 985, 1578, 2368, 3180]
+stat_table = table_utils.build_table()  # Stats of each player, shared by all data sets
 
 
 def load_player_ids_sets(data_sets_file_paths):
-    """Load lists of registered player ids in given data files."""
+    """Load arrays of registered player ids in given data files, in order of first appearance."""
     print("Loading registered player ids from CSV files... ", end='', flush=True)
     player_ids_sets = []
     for data_set_file_paths in data_sets_file_paths:
-        player_ids_set = []
+        player_ids = []
         for data_file_path in data_set_file_paths:
             with open(data_file_path, 'r', newline='') as csv_file:
                 csv_reader = csv.reader(csv_file, delimiter=',')
-                for _, player_id in csv_reader:
-                    if player_id not in player_ids_set and player_id != str(UNKNOWN_ID):
-                        player_ids_set.append(player_id)
-        player_ids_sets.append(player_ids_set)
+                player_ids += [player_id for _, player_id in csv_reader]
+        player_ids = table_utils.to_player_ids(player_ids)
+        player_ids = player_ids[player_ids != UNKNOWN_ID]
+        _, first_indexes = np.unique(player_ids, return_index=True)
+        player_ids_sets.append(player_ids[np.sort(first_indexes)])
     print("Done. Loaded a total of %d valid account ids." % sum(len(_) for _ in player_ids_sets))
     return player_ids_sets
 
 
-def plot_histogram(data_sets, stat_types, data_sets_names, zoom_on_preferred_window=False, *args):
+def plot_histogram(data_sets, stat_types, data_sets_names, zoom_on_preferred_window=False, *args, output_file=None):
     """Plot a set of statistics on an histogram."""
     BINS_IN_PREFERRED_WINDOW = 20
     stat_type = stat_types[0]
     preferred_lb, preferred_ub, mark_step = [stat_type[key] for key in ('preferred_lb', 'preferred_ub', 'mark_step_hist')]
     exp_values_d = wn8_utils.get_exp_values_d() if stat_type['use_exp_values'] else None
+    prefetch_stats([player_ids for player_ids in data_sets if not has_stats_summary(stat_type, player_ids)], stat_types, exp_values_d)
 
-    stats_array, bin_number_array, lb_array, ub_array = [], [], [], []
-    for set_id, player_ids in enumerate(data_sets):
-        # Fetch and compute statistics of accounts
-        stats_d = get_stats(stat_type, set_id, None, player_ids, exp_values_d)
-        if stats_d:
-            stats_array.append(list(stats_d.values()))
+    summaries, bin_number_array, lb_array, ub_array = [], [], [], []
+    for player_ids in data_sets:
+        # Fetch and summarize statistics of accounts
+        summary = get_stats_summary(stat_type, player_ids, exp_values_d)
+        if summary['count'] > 0:
+            summaries.append(summary)
 
             # Compute lower and upper bound of stats
-            min_stat, max_stat = min(stats_d.values()), max(stats_d.values())
+            min_stat, max_stat = summary['min'], summary['max']
             lb = preferred_lb if zoom_on_preferred_window and preferred_lb != 0 else int(math.floor(math.floor(min_stat / mark_step) * mark_step))
             ub = preferred_ub if zoom_on_preferred_window and preferred_ub != 0 else int(math.ceil(math.ceil(max_stat / mark_step) * mark_step))
             lb_array.append(lb)
@@ -83,50 +107,48 @@ def plot_histogram(data_sets, stat_types, data_sets_names, zoom_on_preferred_win
             bin_number = BINS_IN_PREFERRED_WINDOW * bins_factor
 
             # Compute number of bins to adjust on marks
-            marks = round((ub - lb) / mark_step)
+            marks = max(1, round((ub - lb) / mark_step))
             bin_number = marks if bin_number <= marks else round(bin_number / marks) * marks
             bin_number_array.append(bin_number)
 
     if bin_number_array:
         bin_number, lb, ub = max(bin_number_array), min(lb_array), max(ub_array)
-        bin_range = [lb, ub] if lb < ub else None
-        weights = [[len(stats_array[0])/len(stats_array[i]) for _ in range(len(stats_array[i]))] for i in range(len(stats_array))]
-        colors = COLORS[:len(stats_array)] if len(stats_array) <= len(COLORS) else None
+        bin_edges = np.linspace(lb, ub if lb < ub else lb + mark_step, num=bin_number + 1)
+        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+        weights = [summary_utils.rebin_summary(summary, bin_edges) * summaries[0]['count'] / summary['count'] for summary in summaries]
+        colors = COLORS[:len(summaries)] if len(summaries) <= len(COLORS) else None
         labels = [', '.join(data_set_names) for data_set_names in data_sets_names]
         x_formatter = ticker.FuncFormatter(lambda x, pos: "{value}{sign}".format(value=int(x), sign=('%' if stat_type['is_percentage'] else '')))
-        y_formatter = ticker.FuncFormatter(lambda y, pos: "{value}%".format(value=int((y * 100) / len(stats_array[0]))))
+        y_formatter = ticker.FuncFormatter(lambda y, pos: "{value}%".format(value=int((y * 100) / summaries[0]['count'])))
 
         plt.title("Distribution of players in regard to their {stat}".format(stat=stat_type['long_name']))
         plt.xlabel("{stat} of players".format(stat=stat_type['long_name']))
         plt.ylabel("player ratio")
         plt.gca().xaxis.set_major_formatter(x_formatter)
         plt.gca().yaxis.set_major_formatter(y_formatter)
-        plt.hist(x=stats_array, bins=bin_number, range=bin_range, weights=weights, color=colors, label=labels, alpha=0.75, ec='black')
+        plt.hist(x=[bin_centers] * len(summaries), bins=bin_edges, weights=weights, color=colors, label=labels, alpha=0.75, ec='black')
         plt.legend()
-        plt.show()
+        show_graph(output_file)
 
 
-def plot_scatter(data_sets, stat_types, data_sets_names, zoom_on_preferred_window=False, *args):
+def plot_scatter(data_sets, stat_types, data_sets_names, zoom_on_preferred_window=False, *args, output_file=None):
     """Plot a set of statistics on an scatter plot."""
     lb_x, ub_x = stat_types[0]['preferred_lb'], stat_types[0]['preferred_ub']
     lb_y, ub_y = stat_types[1]['preferred_lb'], stat_types[1]['preferred_ub']
     exp_values_d = wn8_utils.get_exp_values_d() if any(stat_type['use_exp_values'] for stat_type in stat_types) else None
+    prefetch_stats(data_sets, stat_types, exp_values_d)
 
     for set_id, player_ids in enumerate(data_sets):
         # Fetch and compute statistics of accounts
-        stats_d_array = []
+        stats_array = []
         for axis, stat_type in enumerate(stat_types):
             axis_exp_values_d = exp_values_d if stat_type['use_exp_values'] else None
-            stats_d = get_stats(stat_type, set_id, None, player_ids, axis_exp_values_d)
-            stats_d_array.append(stats_d)
+            stats_array.append(get_stats(stat_type, None, player_ids, axis_exp_values_d))
 
         # Discard incomplete data
-        stats_d_x, stats_d_y = stats_d_array
-        stats_x, stats_y = [], []
-        for player_id in player_ids:
-            if all(player_id in stats_d for stats_d in (stats_d_x, stats_d_y)):
-                stats_x.append(stats_d_x[player_id])
-                stats_y.append(stats_d_y[player_id])
+        stats_x, stats_y = stats_array
+        is_complete = ~np.isnan(stats_x) & ~np.isnan(stats_y)
+        stats_x, stats_y = stats_x[is_complete], stats_y[is_complete]
 
         # Plot results
         label = ', '.join(data_sets_names[set_id])
@@ -149,36 +171,31 @@ def plot_scatter(data_sets, stat_types, data_sets_names, zoom_on_preferred_windo
         if lb_y < ub_y:
             plt.ylim(stat_types[1]['preferred_lb'], stat_types[1]['preferred_ub'])
     plt.legend()
-    plt.show()
+    show_graph(output_file)
 
 
-def plot_curve(data_sets, stat_types, data_sets_names, zoom_on_preferred_window=False, *args):
+def plot_curve(data_sets, stat_types, data_sets_names, zoom_on_preferred_window=False, *args, output_file=None):
     """Plot a set of statistics on a curve."""
     BINS_IN_PREFERRED_WINDOW = 20
     BIN_THRESHOLD = 50
     exp_values_d = wn8_utils.get_exp_values_d() if any(stat_type['use_exp_values'] for stat_type in stat_types) else None
     preferred_lb_x, preferred_ub_x, mark_step_x = [stat_types[0][key] for key in ('preferred_lb', 'preferred_ub', 'mark_step_curve')]
     lb_y, ub_y = [stat_types[1][key] for key in ('preferred_lb', 'preferred_ub')]
+    prefetch_stats(data_sets, stat_types, exp_values_d)
 
     lb_x_array, ub_x_array = [], []
     for set_id, player_ids in enumerate(data_sets):
         # Fetch, compute and clean statistics of accounts
-        stats_d_array = []
+        stats_array = []
         for axis, stat_type in enumerate(stat_types):
             axis_exp_values_d = exp_values_d if stat_type['use_exp_values'] else None
-            stats_d = get_stats(stat_type, set_id, None, player_ids, axis_exp_values_d)
-            stats_d_array.append(stats_d)
-        stats_d_x, stats_d_y = stats_d_array
-        for player_id in player_ids:
-            if player_id not in stats_d_x:
-                if player_id in stats_d_y:
-                    del stats_d_y[player_id]
-            elif player_id not in stats_d_y:
-                if player_id in stats_d_x:
-                    del stats_d_x[player_id]
+            stats_array.append(get_stats(stat_type, None, player_ids, axis_exp_values_d).astype(np.float64))
+        stats_x, stats_y = stats_array
+        is_complete = ~np.isnan(stats_x) & ~np.isnan(stats_y)
+        stats_x, stats_y = stats_x[is_complete], stats_y[is_complete]
 
         # Compute lower and upper bound of stats
-        min_stat_x, max_stat_x = min(stats_d_x.values()), max(stats_d_x.values())
+        min_stat_x, max_stat_x = stats_x.min(), stats_x.max()
         lb_x = preferred_lb_x if zoom_on_preferred_window and preferred_lb_x != 0 else int(math.floor(math.floor(min_stat_x / mark_step_x) * mark_step_x))
         ub_x = preferred_ub_x if zoom_on_preferred_window and preferred_ub_x != 0 else int(math.ceil(math.ceil(max_stat_x / mark_step_x) * mark_step_x))
         lb_x_array.append(lb_x)
@@ -196,21 +213,25 @@ def plot_curve(data_sets, stat_types, data_sets_names, zoom_on_preferred_window=
         marks = round((ub_x - lb_x) / mark_step_x)
         bin_number = marks if bin_number <= marks else round(bin_number / marks) * marks
 
-        # Sort accounts by x stat in bins
+        # Aggregate y stats of accounts in bins of x stat
         bin_space, bin_step = np.linspace(lb_x, ub_x, num=bin_number, endpoint=True, retstep=True)
-        bins = {bin: [] for bin in bin_space}
-        for player_id in stats_d_x.keys():
-            for bin_label in bins:
-                if stats_d_x[player_id] >= float(bin_label) and stats_d_x[player_id] < float(bin_label) + bin_step:
-                    bins[bin_label].append(stats_d_y[player_id])
-        stats_x = [float(bin_label) for bin_label in bins]
-        stats_y = [np.mean(bins[bin_label]) if bins[bin_label] and len(bins[bin_label]) >= BIN_THRESHOLD else None for bin_label in bins]
+        percentiles = CURVE_BAND_PERCENTILES if CURVE_BAND == 'percentiles' else ()
+        binned_stats = get_binned_stats(stats_x, stats_y, np.append(bin_space, bin_space[-1] + bin_step), percentiles)
+        valid_bins = binned_stats['count'] >= BIN_THRESHOLD
+        curve_y = np.where(valid_bins, binned_stats[CURVE_STATISTIC], np.nan)
 
         # Plot results
         label = ', '.join(data_sets_names[set_id])
         color = COLORS[set_id] if set_id < len(COLORS) else None
-        #plt.scatter(x=[x for x in stats_d_x.values()], y=[y for y in stats_d_y.values()], label=label, c=None, marker='.', alpha=0.75)  # Uncomment to add the scatter plot
-        plt.plot(stats_x, stats_y, label=label, c=color, linestyle='-', marker='.', alpha=0.75)
+        #plt.scatter(x=stats_x, y=stats_y, label=label, c=None, marker='.', alpha=0.75)  # Uncomment to add the scatter plot
+        lines = plt.plot(bin_space, curve_y, label=label, c=color, linestyle='-', marker='.', alpha=0.75)
+        if CURVE_BAND == 'percentiles':
+            band_lb, band_ub = [np.where(valid_bins, binned_stats[percentile], np.nan) for percentile in CURVE_BAND_PERCENTILES]
+            plt.fill_between(bin_space, band_lb, band_ub, color=lines[0].get_color(), alpha=0.20)
+        elif CURVE_BAND == 'confidence':
+            margin = 1.96 * binned_stats['std'] / np.sqrt(np.maximum(binned_stats['count'], 1))
+            band_lb, band_ub = [np.where(valid_bins, binned_stats['mean'] + sign * margin, np.nan) for sign in (-1, 1)]
+            plt.fill_between(bin_space, band_lb, band_ub, color=lines[0].get_color(), alpha=0.20)
 
     #plt.plot(WR_REFERENCES, WN8_REFERENCES, label="Reference curve", c='k', linestyle='--', marker='.', alpha=0.75)  # Uncomment to plot WR/WN8 reference curve
 
@@ -229,10 +250,51 @@ def plot_curve(data_sets, stat_types, data_sets_names, zoom_on_preferred_window=
         if lb_y < ub_y:
             plt.ylim(lb_y, ub_y)
     plt.legend()
-    plt.show()
+    show_graph(output_file)
+
+
+def show_graph(output_file=None):
+    """Display the current graph, or render it to file (format given by extension) if provided."""
+    if output_file:
+        with timing_utils.stage('plot rendering', 1):
+            plt.savefig(output_file, bbox_inches='tight')
+        plt.close()
+    else:
+        plt.show()
 
 
-def plot_pie(data_sets, stat_types, data_sets_names, *args):
+def get_binned_stats(stats_x, stats_y, bin_edges, percentiles=()):
+    """Aggregate y stats by bin of x stats, with count, mean, std, median and given percentiles of each bin."""
+    bin_count = len(bin_edges) - 1
+    bin_indexes = np.digitize(stats_x, bin_edges) - 1
+    in_bins = (bin_indexes >= 0) & (bin_indexes < bin_count)
+    bin_indexes, stats_y = bin_indexes[in_bins], stats_y[in_bins]
+
+    counts = np.bincount(bin_indexes, minlength=bin_count)
+    sums = np.bincount(bin_indexes, weights=stats_y, minlength=bin_count)
+    squared_sums = np.bincount(bin_indexes, weights=stats_y ** 2, minlength=bin_count)
+    divisors = np.maximum(counts, 1)
+    means = np.where(counts > 0, sums / divisors, np.nan)
+    variances = np.maximum(squared_sums / divisors - np.nan_to_num(means) ** 2, 0)
+    binned_stats = {'count': counts, 'mean': means, 'std': np.where(counts > 0, np.sqrt(variances), np.nan)}
+
+    # Interpolate percentiles in the y stats sorted by bin then by value
+    sorted_stats_y = stats_y[np.lexsort((stats_y, bin_indexes))]
+    bin_starts = np.cumsum(counts) - counts
+    for percentile in (50,) + tuple(percentiles):
+        positions = bin_starts + (divisors - 1) * percentile / 100
+        lower_positions = np.floor(positions).astype(np.int64)
+        upper_positions = np.ceil(positions).astype(np.int64)
+        values = np.full(bin_count, np.nan)
+        filled = counts > 0
+        lower_values, upper_values = sorted_stats_y[lower_positions[filled]], sorted_stats_y[upper_positions[filled]]
+        values[filled] = lower_values + (upper_values - lower_values) * (positions[filled] - lower_positions[filled])
+        binned_stats[percentile] = values
+    binned_stats['median'] = binned_stats[50]
+    return binned_stats
+
+
+def plot_pie(data_sets, stat_types, data_sets_names, *args, output_file=None):
     """Group players by statistic value on a pie chart."""
     EXPLODE_FACTOR = 0.1
     RATIO_THRESHOLD = 0.05
@@ -240,13 +302,12 @@ def plot_pie(data_sets, stat_types, data_sets_names, *args):
     data_sets_name = '({name})'.format(name=', '.join(data_sets_names[0])) if len(data_sets_names) == 1 else ''
 
     stat_count_d = {}
+    prefetch_stats(data_sets, stat_types)
     for set_id, player_ids in enumerate(data_sets):
         set_name = ', '.join(data_sets_names[set_id])
-        stats_d = get_stats(stat_type, set_id, set_name, player_ids)
-        for player_id, stat in stats_d.items():
-            if stat not in stat_count_d:
-                stat_count_d[stat] = 0
-            stat_count_d[stat] += 1
+        labels = get_stats(stat_type, set_name, player_ids)
+        for stat, count in zip(*np.unique(labels[labels != None].astype(str), return_counts=True)):
+            stat_count_d[stat] = stat_count_d.get(stat, 0) + int(count)
 
     if stat_count_d:
         # Merge smaller groups
@@ -271,55 +332,166 @@ def plot_pie(data_sets, stat_types, data_sets_names, *args):
         plt.pie(x=counts, colors=colors, labels=labels, explode=explodes, autopct='%1.1f%%', startangle=90)
         plt.axis('equal')
         plt.tight_layout()
-        plt.show()
+        show_graph(output_file)
+
 
+def prefetch_stats(data_sets, stat_types, exp_values_d=None):
+    """Fetch the stats of the union of the data sets, so that players shared by several sets are fetched once."""
+    prefetch_planned_stats([(stat_type, data_sets) for stat_type in stat_types], exp_values_d)
 
-def get_stats(stat_type, set_id, set_name, player_ids, exp_values_d=None):
-    """Split the list of player ids in batches and get their stats."""
-    stats_fetcher, stat_name = stat_type['stats_fetcher'], stat_type['short_name']
-    stats_d = {}
-    index, batches = 0, []
-    while index < len(player_ids):
-        batches.append(player_ids[index:min(index + BATCH_SIZE, len(player_ids))])
-        index += len(batches[-1])
-    for batch_id, batch in enumerate(batches):
-        batch_d = {}
+
+def prefetch_planned_stats(stat_plans, exp_values_d=None):
+    """Fetch each stat of a plan for the union of its data sets, reporting the players left to fetch once for the plan."""
+    fetches, planned_data_sets = [], {}
+    for stat_type, data_sets in stat_plans:
+        if data_sets and is_player_stat(stat_type):
+            player_ids = np.unique(np.concatenate(data_sets))
+            missing_player_ids = table_utils.get_unfetched_player_ids(stat_table, stat_type['short_name'], player_ids)
+            if len(missing_player_ids) == 0:
+                timing_utils.count('stats cache hits')
+            else:
+                missing_player_ids = load_stored_stats(stat_type, missing_player_ids)
+            fetches.append((stat_type, missing_player_ids))
+            planned_data_sets.update((id(player_ids), player_ids) for player_ids in data_sets)
+    missing_player_ids_list = [missing_player_ids for _, missing_player_ids in fetches if len(missing_player_ids) > 0]
+    if len(planned_data_sets) > 1 and missing_player_ids_list:
+        print("Planned the fetch of %d unique players out of %d in %d data sets." % (
+            len(np.unique(np.concatenate(missing_player_ids_list))),
+            sum(len(player_ids) for player_ids in planned_data_sets.values()), len(planned_data_sets)
+        ))
+    for stat_type, missing_player_ids in fetches:
+        if len(missing_player_ids) > 0:
+            fetch_player_stats(stat_type, missing_player_ids, exp_values_d if stat_type['use_exp_values'] else None)
+
+
+def is_player_stat(stat_type):
+    """Tell whether the stat only depends on the player, and not on the data set it belongs to."""
+    return 'expression' in stat_type or 'field' in stat_type or stat_type['use_exp_values']
+
+
+def fetch_player_stats(stat_type, player_ids, exp_values_d=None):
+    """Fetch the stat of players not fetched yet, in concurrent batches, and register it in the stat table."""
+    stat_name = stat_type['short_name']
+    missing_player_ids = table_utils.get_unfetched_player_ids(stat_table, stat_name, player_ids)
+    if len(missing_player_ids) == 0:
+        timing_utils.count('stats cache hits')
+        return
+    missing_player_ids = load_stored_stats(stat_type, missing_player_ids)
+    if len(missing_player_ids) == 0:
+        return
+    timing_utils.count('stats cache misses')
+    batches = [missing_player_ids[index:index + BATCH_SIZE].astype(str).tolist() for index in range(0, len(missing_player_ids), BATCH_SIZE)]
+    failed_player_count = 0
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        batch_ds = executor.map(lambda batch: get_batch_stats(stat_type, batch, None, exp_values_d), batches)
+        for batch_id, (batch, batch_d) in enumerate(zip(batches, batch_ds)):
+            if batch_d is None:  # Left unfetched, so that it is fetched again when next needed
+                failed_player_count += len(batch)
+            else:
+                table_utils.set_stats(stat_table, stat_name, batch, batch_d, stat_type['group_by_value'])
+            progress = (batch_id + 1) / len(batches) * 100
+            sys.stdout.write("\rCalculating %s for %d players : %.2f %%" % (stat_name, len(missing_player_ids), progress))
+            sys.stdout.flush()
+    print()
+    if failed_player_count > 0:
+        print("Failed to fetch the %s of %d players, their stat is missing." % (stat_name, failed_player_count))
+
+
+def load_stored_stats(stat_type, player_ids):
+    """Register the stats of players recently stored by the player_lister, and return the ids of the others."""
+    store = store_utils.load_store(STORE_FILE)
+    if store is None or 'expression' not in stat_type:
+        return player_ids
+    compiled_expression = expression_utils.compile_expression(stat_type['expression'])
+    if any(field not in store['fields'] for field in compiled_expression['fields']):
+        return player_ids
+    stored_player_ids, columns = store_utils.get_stored_columns(store, compiled_expression['fields'], player_ids, STORE_MAX_AGE)
+    stats = expression_utils.evaluate_columns(compiled_expression, columns, len(stored_player_ids))
+    if stat_type.get('positive_only'):
+        stats[~(stats > 0)] = np.nan
+    table_utils.set_stat_array(stat_table, stat_type['short_name'], stored_player_ids, stats)
+    timing_utils.count('stored stats', len(stored_player_ids))
+    return np.setdiff1d(player_ids, stored_player_ids)
+
+
+def get_batch_stats(stat_type, batch, set_name, exp_values_d=None):
+    """Get the stats of a batch of players with the fetcher of the stat, or None if the request failed."""
+    stats_fetcher = stat_type['stats_fetcher']
+    with timing_utils.stage('stats %s' % stat_type['short_name'], len(batch)):
         if stat_type['use_exp_values']:
-            batch_d = stats_fetcher(batch, exp_values_d, APP_ID)
+            return stats_fetcher(batch, exp_values_d, APP_ID)
         elif stat_type['group_by_value']:
-            batch_d = stats_fetcher(batch, stat_type, APP_ID, set_name)
+            return stats_fetcher(batch, stat_type, APP_ID, set_name)
         else:
-            batch_d = stats_fetcher(batch, stat_type, APP_ID)
-        for player_id, stat in batch_d.items():
-            stats_d[player_id] = stat
-        progress = (batch_id + 1) / len(batches) * 100
-        sys.stdout.write("\rCalculating %s for set #%d : %.2f %%" % (stat_name, set_id + 1, progress))
-        sys.stdout.flush()
-    print()
-    return stats_d
+            return stats_fetcher(batch, stat_type, APP_ID)
+
+
+def get_stats(stat_type, set_name, player_ids, exp_values_d=None):
+    """Get the stats of a set of players aligned with their ids, NaN (or None for labels) if missing, fetching only those not already fetched for another set."""
+    if not is_player_stat(stat_type):  # Stats depending on the set are computed per set
+        stats_d = get_batch_stats(stat_type, player_ids.astype(str).tolist(), set_name, exp_values_d)
+        return np.array([stats_d.get(player_id) for player_id in player_ids.astype(str)], dtype=object)
+    fetch_player_stats(stat_type, player_ids, exp_values_d)
+    if stat_type['group_by_value']:
+        return table_utils.get_labels(stat_table, stat_type['short_name'], player_ids)
+    return table_utils.get_stats(stat_table, stat_type['short_name'], player_ids)
+
+
+def get_stats_summary(stat_type, player_ids, exp_values_d=None):
+    """Load the histogram summary of the stats of a set of players, or compute and register it if outdated."""
+    summary_file_path = get_summary_file_path(stat_type, player_ids)
+    summary = summary_utils.load_summary(summary_file_path, SUMMARY_MAX_AGE)
+    timing_utils.count('summary cache hits' if summary is not None else 'summary cache misses')
+    if summary is None:
+        stats = get_stats(stat_type, None, player_ids, exp_values_d)
+        summary = summary_utils.build_summary(stats[~np.isnan(stats)], stat_type['mark_step_hist'] / SUMMARY_BINS_PER_MARK)
+        ui_utils.prepare_folders(SUMMARIES_FOLDER)
+        summary_utils.save_summary(summary, summary_file_path)
+    return summary
+
+
+def has_stats_summary(stat_type, player_ids):
+    """Tell whether an up-to-date histogram summary of the stats of a set of players is registered."""
+    return summary_utils.load_summary(get_summary_file_path(stat_type, player_ids), SUMMARY_MAX_AGE) is not None
+
+
+def get_summary_file_path(stat_type, player_ids):
+    """Get the path of the histogram summary of the stats of a set of players."""
+    summary_key = hashlib.sha1('|'.join([stat_type['short_name']] + sorted(player_ids.astype(str).tolist())).encode()).hexdigest()
+    return SUMMARY_FILE_FORMAT % summary_key
 
 
 def get_wn8_d(player_ids, exp_values_d, app_id):
-    """Compute the WN8 of a batch of players."""
+    """Compute the WN8 of a batch of players, or None if the request failed."""
     wn8_d = wn8_utils.calculate_wn8(player_ids, exp_values_d, app_id)
     return wn8_d
 
 
-def get_total_stat_d(player_ids, stat_type, app_id):
-    """Compute the total stat of a batch of players."""
-    return get_stat_d(player_ids, stat_type, stat_type['field'], app_id)
-
+def get_recent_wn8_d(player_ids, exp_values_d, app_id):
+    """Compute the recent WN8 of a batch of players from stored snapshots."""
+    recent_wn8_d = wn8_utils.calculate_recent_wn8(player_ids, exp_values_d)
+    return recent_wn8_d
 
-def get_average_stat_d(player_ids, stat_type, app_id):
-    """Compute the average stat of a batch of players."""
-    fields = ','.join([stat_type['field'], stat_type['dependency_field']])
-    return get_stat_d(player_ids, stat_type, fields, app_id, compute_ratio=True, per_shot=False)
 
+def get_expression_stat_d(player_ids, stat_type, app_id):
+    """Compute the stat of a batch of players from the expression of its fields, or None if the request failed."""
+    compiled_expression = expression_utils.compile_expression(stat_type['expression'])
+    payload = {
+        'application_id': app_id,
+        'account_id': ','.join(player_ids),
+        'fields': ','.join(compiled_expression['fields'])
+    }
+    response_content = api_utils.request('account/info', payload)
 
-def get_per_shot_stat_d(player_ids, stat_type, app_id):
-    """Compute the average stat per shot of a batch of players."""
-    fields = ','.join([stat_type['field'], stat_type['dependency_field']])
-    return get_stat_d(player_ids, stat_type, fields, app_id, compute_ratio=False, per_shot=True)
+    stat_d = None
+    if response_content['status'] == 'ok':
+        player_ids = [player_id for player_id in player_ids if response_content['data'][player_id]]
+        stats = expression_utils.evaluate_expression(compiled_expression, [response_content['data'][player_id] for player_id in player_ids])
+        is_valid = ~np.isnan(stats)
+        if stat_type.get('positive_only'):
+            is_valid[is_valid] = stats[is_valid] > 0
+        stat_d = {player_id: stat for player_id, stat, valid in zip(player_ids, stats.tolist(), is_valid) if valid}
+    return stat_d
 
 
 def get_count_d(player_ids, stat_type, app_id, set_name):
@@ -330,50 +502,157 @@ def get_count_d(player_ids, stat_type, app_id, set_name):
 
 def get_language_d(player_ids, stat_type, app_id, set_name):
     """Compute the count of a batch of players for a given set."""
-    return get_stat_d(player_ids, stat_type, stat_type['field'], app_id)
+    return get_stat_d(player_ids, stat_type, app_id)
 
 
-def get_stat_d(player_ids, stat_type, fields, app_id, compute_ratio=False, per_shot=False):
-    """Compute the stat of a batch of players."""
+def get_stat_d(player_ids, stat_type, app_id):
+    """Get the raw value of the field of a stat for a batch of players, or None if the request failed."""
     payload = {
         'application_id': app_id,
         'account_id': ','.join(player_ids),
-        'fields': fields
+        'fields': stat_type['field']
     }
-    response = requests.get(ACCOUNT_INFO_REQUEST_URL, params=payload)
-    response_content = response.json()
+    response_content = api_utils.request('account/info', payload)
 
-    stat_d = {}
+    stat_d = None
     if response_content['status'] == 'ok':
+        stat_d = {}
+        accessor = expression_utils.compile_accessor(stat_type['field'])
         for player_id in player_ids:
             player_data = response_content['data'][player_id]
             if player_data:
-                stat = get_nested_stat(stat_type['field'], player_data)
-                if compute_ratio:
-                    battles = get_nested_stat(stat_type['dependency_field'], player_data)
-                    average_stat = stat / battles if battles > 0 else 0
-                    if stat_type['is_percentage']:
-                        average_stat *= 100
-                    if average_stat > 0:
-                        stat_d[player_id] = average_stat
-                elif per_shot:
-                    shots = get_nested_stat(stat_type['dependency_field'], player_data)
-                    per_shot_stat = stat / shots if shots > 0 else 0
-                    if stat_type['is_percentage']:
-                        per_shot_stat *= 100
-                    if per_shot_stat > 0:
-                        stat_d[player_id] = per_shot_stat
-                else:
-                    stat_d[player_id] = stat
+                stat_d[player_id] = accessor(player_data)
     return stat_d
 
 
-def get_nested_stat(nested_field, player_data):
-    """Get the stat for the given nested field."""
-    stat = player_data
-    for field_part in nested_field.split('.'):
-        stat = stat[field_part]
-    return stat
+def run_batch(plot_specs, workers=1):
+    """Render graphs described by plot specifications to files, without user interaction."""
+    plt.switch_backend('Agg')
+    ui_utils.prepare_folders(DATA_FOLDER, CATEGORIES_FOLDER, PLOTS_FOLDER)
+    data_options = dict(ui_utils.list_data_options(CATEGORIES_FOLDER, DATA_FOLDER))
+    plot_jobs, player_ids_sets_d = [], {}
+    for plot_spec in plot_specs:
+        data_sets_files = [[data_options[name] for name in data_set_names] for data_set_names in plot_spec['data_sets']]
+        data_sets = []
+        for data_set_files in data_sets_files:  # Load each distinct data set only once
+            if tuple(data_set_files) not in player_ids_sets_d:
+                player_ids_sets_d[tuple(data_set_files)] = load_player_ids_sets([data_set_files])[0]
+            data_sets.append(player_ids_sets_d[tuple(data_set_files)])
+        plot_jobs.append(dict(plot_spec, data_sets_names=plot_spec['data_sets'], data_sets=data_sets))
+
+    # Fetch the stats of all plots in this process so that players shared by data sets are fetched once
+    stat_sets_d = {}
+    for plot_job in plot_jobs:
+        for stat_id in plot_job['stats']:
+            stat_type = stat_enum.STATS[stat_id]
+            stat_sets = stat_sets_d.setdefault(stat_id, [])
+            for player_ids in plot_job['data_sets']:
+                if plot_job['graph'] != 'hist' or not has_stats_summary(stat_type, player_ids):
+                    stat_sets.append(player_ids)
+    exp_values_d = wn8_utils.get_exp_values_d() if any(stat_enum.STATS[stat_id]['use_exp_values'] for stat_id in stat_sets_d) else None
+    prefetch_planned_stats([(stat_enum.STATS[stat_id], stat_sets) for stat_id, stat_sets in stat_sets_d.items()], exp_values_d)
+    for plot_job in plot_jobs:  # Register the summaries to share with rendering processes
+        if plot_job['graph'] == 'hist':
+            stat_type = stat_enum.STATS[plot_job['stats'][0]]
+            for player_ids in plot_job['data_sets']:
+                get_stats_summary(stat_type, player_ids, exp_values_d if stat_type['use_exp_values'] else None)
+
+    print("Rendering %d graphs with %d worker(s)... " % (len(plot_jobs), workers), end='', flush=True)
+    if workers > 1:
+        worker_state = (APP_ID, (api_utils.API_BASE_URL, api_utils.EXP_VALUES_FILE_URL), stat_table, wn8_utils.exp_values_cache)
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_worker_state, initargs=worker_state) as executor:
+            output_files = []
+            for output_file, timing_totals in executor.map(render_worker_plot, plot_jobs):
+                output_files.append(output_file)
+                timing_utils.merge_totals(*timing_totals)
+    else:
+        output_files = [render_plot(plot_job) for plot_job in plot_jobs]
+    print("Done.")
+    for output_file in output_files:
+        print("  {file}".format(file=os.path.abspath(output_file)))
+
+
+def load_worker_state(app_id, api_urls, loaded_stat_table, exp_values_cache):
+    """Share the application id, API locations and fetched stats with a rendering process."""
+    global APP_ID
+    APP_ID = app_id
+    api_utils.set_api_urls(*api_urls)
+    stat_table.update(loaded_stat_table)
+    wn8_utils.exp_values_cache.update(exp_values_cache)
+    timing_utils.take_totals()  # Forked processes start with the totals of the parent, already reported by it
+
+
+def render_worker_plot(plot_job):
+    """Render a graph to file in a rendering process, returning the stage totals measured meanwhile along with it."""
+    output_file = render_plot(plot_job)
+    return output_file, timing_utils.take_totals()
+
+
+def render_plot(plot_job):
+    """Render a graph to file from a plot job."""
+    plt.switch_backend('Agg')
+    graph_properties = GRAPH_TYPES[plot_job['graph']]
+    stat_types = [stat_enum.STATS[stat_id] for stat_id in plot_job['stats']]
+    graph_properties['plotter'](
+        plot_job['data_sets'], stat_types, plot_job['data_sets_names'], plot_job['zoom'], output_file=plot_job['output']
+    )
+    plt.close('all')
+    return plot_job['output']
+
+
+def parse_plot_specs(argument_parser, arguments):
+    """Build and validate plot specifications from command line arguments or config file."""
+    if arguments.config:
+        with open(arguments.config, 'r') as config_file:
+            plot_specs = json.load(config_file)
+    else:
+        plot_specs = [{
+            'graph': arguments.graph,
+            'stats': arguments.stats,
+            'data_sets': [data_set.split(',') for data_set in arguments.sets],
+            'zoom': arguments.zoom,
+            'output': arguments.output
+        }]
+
+    data_option_names = [name for name, _ in ui_utils.list_data_options(CATEGORIES_FOLDER, DATA_FOLDER)]
+    for plot_spec in plot_specs:
+        graph_properties = GRAPH_TYPES.get(plot_spec.get('graph'))
+        if not graph_properties:
+            argument_parser.error("unknown graph type: {graph}".format(graph=plot_spec.get('graph')))
+        stats, data_sets = plot_spec.get('stats') or [], plot_spec.get('data_sets') or []
+        if len(stats) != len(graph_properties['axis']) or any(stat not in graph_properties['allowed_stats'] for stat in stats):
+            argument_parser.error("a {name} requires {number} stat(s) among: {stats}".format(
+                name=graph_properties['name'], number=len(graph_properties['axis']), stats=', '.join(graph_properties['allowed_stats'])
+            ))
+        if not graph_properties['min_data_sets_number'] <= len(data_sets) <= graph_properties['max_data_sets_number']:
+            argument_parser.error("a {name} requires between {min} and {max} data sets".format(
+                name=graph_properties['name'], min=graph_properties['min_data_sets_number'], max=graph_properties['max_data_sets_number']
+            ))
+        for name in [name for data_set_names in data_sets for name in data_set_names]:
+            if name not in data_option_names:
+                argument_parser.error("unknown data file: {name}".format(name=name))
+        plot_spec['zoom'] = bool(plot_spec.get('zoom')) and graph_properties['is_zoomable']
+        if not plot_spec.get('output'):
+            plot_spec['output'] = PLOT_FILE_FORMAT % '_'.join(
+                [plot_spec['graph']] + stats + ['+'.join(data_set_names) for data_set_names in data_sets]
+            )
+    return plot_specs
+
+
+def parse_arguments():
+    """Parse the command line arguments of the batch mode."""
+    argument_parser = argparse.ArgumentParser(description="Render graphs of player stats to PNG/SVG files.")
+    argument_parser.add_argument('--config', help="JSON file listing plot specifications (graph, stats, data_sets, zoom, output)")
+    argument_parser.add_argument('--graph', choices=list(GRAPH_TYPES), help="type of the graph")
+    argument_parser.add_argument('--stats', nargs='+', default=[], help="stat of each axis of the graph")
+    argument_parser.add_argument('--set', dest='sets', action='append', default=[], help="comma-separated data files of a data set (repeatable)")
+    argument_parser.add_argument('--zoom', action='store_true', help="zoom on the preferred window of the stats")
+    argument_parser.add_argument('--output', help="output file, whose extension (.png, .svg) gives the format")
+    argument_parser.add_argument('--workers', type=int, default=1, help="number of rendering processes")
+    arguments = argument_parser.parse_args()
+    if not arguments.config and not arguments.graph:
+        argument_parser.error("either --config or --graph is required")
+    return parse_plot_specs(argument_parser, arguments), max(1, arguments.workers)
 
 
 GRAPH_TYPES = {
@@ -381,10 +660,11 @@ GRAPH_TYPES = {
         'plotter': plot_histogram,
         'name': "histogram",
         'axis': ['x'],
-        'allowed_stats': ['battles', 'wn8', 'global_rating', 'wr', 'avg_xp',
-                          'avg_damage', 'avg_assist', 'avg_blocked', 'avg_kill',
-                          'avg_spot', 'hit_ratio', 'avg_capture', 'avg_defense',
-                          'splash_ratio'],
+        'allowed_stats': ['battles', 'wn8', 'recent_wn8', 'global_rating', 'wr',
+                          'avg_xp', 'avg_damage', 'avg_assist', 'avg_blocked',
+                          'avg_kill', 'avg_spot', 'hit_ratio', 'avg_capture',
+                          'avg_defense', 'splash_ratio', 'damage_ratio',
+                          'survival_rate', 'kd_ratio'],
         'min_data_sets_number': 1,
         'max_data_sets_number': 5,
         'is_zoomable': True,
@@ -393,10 +673,11 @@ GRAPH_TYPES = {
         'plotter': plot_scatter,
         'name': "scatter plot",
         'axis': ['x', 'y'],
-        'allowed_stats': ['battles', 'wn8', 'global_rating', 'wr', 'avg_xp',
-                          'avg_damage', 'avg_assist', 'avg_blocked', 'avg_kill',
-                          'avg_spot', 'hit_ratio', 'avg_capture', 'avg_defense',
-                          'splash_ratio'],
+        'allowed_stats': ['battles', 'wn8', 'recent_wn8', 'global_rating', 'wr',
+                          'avg_xp', 'avg_damage', 'avg_assist', 'avg_blocked',
+                          'avg_kill', 'avg_spot', 'hit_ratio', 'avg_capture',
+                          'avg_defense', 'splash_ratio', 'damage_ratio',
+                          'survival_rate', 'kd_ratio'],
         'min_data_sets_number': 1,
         'max_data_sets_number': 5,
         'is_zoomable': True
@@ -405,10 +686,11 @@ GRAPH_TYPES = {
         'plotter': plot_curve,
         'name': "curve",
         'axis': ['x', 'y'],
-        'allowed_stats': ['battles', 'wn8', 'global_rating', 'wr', 'avg_xp',
-                          'avg_damage', 'avg_assist', 'avg_blocked', 'avg_kill',
-                          'avg_spot', 'hit_ratio', 'avg_capture', 'avg_defense',
-                          'splash_ratio'],
+        'allowed_stats': ['battles', 'wn8', 'recent_wn8', 'global_rating', 'wr',
+                          'avg_xp', 'avg_damage', 'avg_assist', 'avg_blocked',
+                          'avg_kill', 'avg_spot', 'hit_ratio', 'avg_capture',
+                          'avg_defense', 'splash_ratio', 'damage_ratio',
+                          'survival_rate', 'kd_ratio'],
         'min_data_sets_number': 1,
         'max_data_sets_number': 5,
         'is_zoomable': True
@@ -425,6 +707,15 @@ GRAPH_TYPES = {
 }
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:  # Batch mode
+        ui_utils.prepare_folders(DATA_FOLDER, CATEGORIES_FOLDER)
+        plot_specs, workers = parse_arguments()
+        APP_ID = ui_utils.load_app_id(CONFIG_FILE, APP_ID)
+        api_utils.load_api_urls(CONFIG_FILE)
+        timing_utils.enable_report(CONFIG_FILE)
+        run_batch(plot_specs, workers)
+        sys.exit()
+
     input("The module player_profiler helps you plotting statistics of players "
           "whose account id has been registered by the previous modules.\n"
           "You will be asked to choose the type of the graph you want to plot "
@@ -436,6 +727,8 @@ if __name__ == "__main__":
           "Press ENTER to continue (or CTRL + C + ENTER to abort).\n")
 
     APP_ID = ui_utils.load_app_id(CONFIG_FILE, APP_ID)
+    api_utils.load_api_urls(CONFIG_FILE)
+    timing_utils.enable_report(CONFIG_FILE)
     ui_utils.prepare_folders(DATA_FOLDER, CATEGORIES_FOLDER)
 
     graph_properties = ui_utils.select_graph_type(
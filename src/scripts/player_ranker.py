@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""Rank players by percentile of their stats against the server population."""
+
+import os
+import sys
+import csv
+import time
+import hashlib
+import argparse
+
+import numpy as np
+
+import api_utils
+import stat_enum
+import player_profiler as profiler
+import timing_utils
+import ui_utils
+import wn8_utils
+
+CONFIG_FILE = '../../res/config.txt'
+DATA_FOLDER = '../../data'
+CATEGORIES_FOLDER = '{data_folder}/categories'.format(data_folder=DATA_FOLDER)
+SERVER_FILE = '{data_folder}/SERVER.csv'.format(data_folder=DATA_FOLDER)
+BASELINES_FOLDER = '{data_folder}/baselines'.format(data_folder=DATA_FOLDER)
+BASELINE_FILE_FORMAT = '{baselines_folder}/%s.npz'.format(baselines_folder=BASELINES_FOLDER)
+RANKINGS_FOLDER = '{data_folder}/rankings'.format(data_folder=DATA_FOLDER)
+RANKING_FILE_FORMAT = '{rankings_folder}/%s.csv'.format(rankings_folder=RANKINGS_FOLDER)
+BASELINE_MAX_AGE = 7 * 24 * 3600
+RANKED_STATS = ['wn8', 'wr', 'battles', 'avg_damage', 'hit_ratio']
+
+
+def load_player_names(data_sets_file_paths):
+    """Load the name of registered players by account id."""
+    player_names = {}
+    for data_set_file_paths in data_sets_file_paths:
+        for data_file_path in data_set_file_paths:
+            with open(data_file_path, 'r', newline='') as csv_file:
+                csv_reader = csv.reader(csv_file, delimiter=',')
+                for player_name, player_id in csv_reader:
+                    player_names[int(player_id)] = player_name
+    return player_names
+
+
+def load_baselines(stat_ids, server_player_ids, should_rebuild=False):
+    """Load the sorted stats of the server sample for each stat, building and registering those missing or outdated."""
+    sample_key = hashlib.sha1(np.sort(server_player_ids).tobytes()).hexdigest()
+    baselines = {} if should_rebuild else {stat_id: load_baseline(stat_id, sample_key) for stat_id in stat_ids}
+    missing_stat_ids = [stat_id for stat_id in stat_ids if baselines.get(stat_id) is None]
+    if missing_stat_ids:
+        print("Building baselines of {stats} from {count} players of the server sample.".format(
+            stats=', '.join(stat_enum.STATS[stat_id]['short_name'] for stat_id in missing_stat_ids), count=len(server_player_ids)
+        ))
+        stat_types = [stat_enum.STATS[stat_id] for stat_id in missing_stat_ids]
+        exp_values_d = wn8_utils.get_exp_values_d() if any(stat_type['use_exp_values'] for stat_type in stat_types) else None
+        for stat_id, stat_type in zip(missing_stat_ids, stat_types):
+            stats = profiler.get_stats(stat_type, None, server_player_ids, exp_values_d if stat_type['use_exp_values'] else None)
+            with timing_utils.stage('baseline building', len(stats)):
+                baselines[stat_id] = np.sort(stats[~np.isnan(stats)])
+            save_baseline(stat_id, baselines[stat_id], sample_key)
+    return baselines
+
+
+def load_baseline(stat_id, sample_key):
+    """Load the baseline of a stat, unless missing, outdated or built from another server sample."""
+    baseline_file_path = BASELINE_FILE_FORMAT % stat_id
+    if not os.path.exists(baseline_file_path):
+        return None
+    with np.load(baseline_file_path) as baseline_file:
+        if baseline_file['sample_key'].item() != sample_key or time.time() - baseline_file['timestamp'].item() > BASELINE_MAX_AGE:
+            return None
+        return baseline_file['stats']
+
+
+def save_baseline(stat_id, baseline, sample_key):
+    """Register the baseline of a stat to file."""
+    ui_utils.prepare_folders(BASELINES_FOLDER)
+    np.savez(BASELINE_FILE_FORMAT % stat_id, stats=baseline, sample_key=sample_key, timestamp=int(time.time()))
+
+
+def get_percentiles(baseline, stats):
+    """Get the percentile of stats in the baseline, using the middle rank of tied values, NaN for missing stats."""
+    if len(baseline) == 0:
+        return np.full(len(stats), np.nan)
+    lower_ranks = np.searchsorted(baseline, stats, side='left')
+    upper_ranks = np.searchsorted(baseline, stats, side='right')
+    percentiles = (lower_ranks + upper_ranks) / 2 / len(baseline) * 100
+    return np.where(np.isnan(stats), np.nan, percentiles)
+
+
+def rank_players(data_sets, baselines):
+    """Get the stats of the players of each data set along with their percentiles."""
+    stat_types = [stat_enum.STATS[stat_id] for stat_id in baselines]
+    exp_values_d = wn8_utils.get_exp_values_d() if any(stat_type['use_exp_values'] for stat_type in stat_types) else None
+    profiler.prefetch_stats(data_sets, stat_types, exp_values_d)
+    rankings = []
+    for player_ids in data_sets:
+        ranking = {}
+        for stat_id, stat_type in zip(baselines, stat_types):
+            stats = profiler.get_stats(stat_type, None, player_ids, exp_values_d if stat_type['use_exp_values'] else None)
+            with timing_utils.stage('percentile ranking', len(player_ids)):
+                ranking[stat_id] = (stats, get_percentiles(baselines[stat_id], stats))
+        rankings.append(ranking)
+    return rankings
+
+
+def print_category_report(data_sets_names, data_sets, rankings):
+    """Print the median percentile of the players of each data set for each stat."""
+    stat_names = [stat_enum.STATS[stat_id]['short_name'] for stat_id in rankings[0]] if rankings else []
+    print("Median percentile of players against the server sample:")
+    print("  {:<24}{:>9}".format("data set", "players") + ''.join("{:>16}".format(stat_name) for stat_name in stat_names))
+    for data_set_names, player_ids, ranking in zip(data_sets_names, data_sets, rankings):
+        median_percentiles = []
+        for stats, percentiles in ranking.values():
+            ranked_percentiles = percentiles[~np.isnan(percentiles)]
+            median_percentiles.append("%.1f" % np.median(ranked_percentiles) if len(ranked_percentiles) > 0 else '-')
+        print("  {:<24}{:>9}".format(', '.join(data_set_names), len(player_ids)) + ''.join("{:>16}".format(value) for value in median_percentiles))
+
+
+def register_player_reports(data_sets_names, data_sets, rankings, player_names):
+    """Register the stats and percentiles of each player of each data set in CSV files."""
+    ui_utils.prepare_folders(RANKINGS_FOLDER)
+    ranking_file_paths = []
+    for data_set_names, player_ids, ranking in zip(data_sets_names, data_sets, rankings):
+        ranking_file_path = RANKING_FILE_FORMAT % '+'.join(data_set_names)
+        with open(ranking_file_path, 'w', newline='') as csv_file:
+            csv_writer = csv.writer(csv_file, delimiter=',')
+            header = ['name', 'id']
+            for stat_id in ranking:
+                stat_name = stat_enum.STATS[stat_id]['short_name']
+                header += [stat_name, '{stat} percentile'.format(stat=stat_name)]
+            csv_writer.writerow(header)
+            columns = [column for stats, percentiles in ranking.values() for column in (stats, percentiles)]
+            for row, player_id in enumerate(player_ids.tolist()):
+                values = ['' if np.isnan(column[row]) else "%.2f" % column[row] for column in columns]
+                csv_writer.writerow([player_names.get(player_id, ''), player_id] + values)
+        ranking_file_paths.append(ranking_file_path)
+    return ranking_file_paths
+
+
+def run_ranking(data_sets_names, data_sets_files, stat_ids, should_rebuild=False):
+    """Rank the players of the data sets against the server sample and report the results."""
+    server_player_ids = profiler.load_player_ids_sets([[SERVER_FILE]])[0]
+    baselines = load_baselines(stat_ids, server_player_ids, should_rebuild)
+    data_sets = profiler.load_player_ids_sets(data_sets_files)
+    rankings = rank_players(data_sets, baselines)
+    print_category_report(data_sets_names, data_sets, rankings)
+    print("Registering per player reports to CSV files... ", end='', flush=True)
+    ranking_file_paths = register_player_reports(data_sets_names, data_sets, rankings, load_player_names(data_sets_files))
+    print("Done.")
+    for ranking_file_path in ranking_file_paths:
+        print("  {file}".format(file=os.path.abspath(ranking_file_path)))
+
+
+def parse_arguments():
+    """Parse the command line arguments of the batch mode."""
+    ranked_stat_ids = [stat_id for stat_id, stat_type in stat_enum.STATS.items() if not stat_type['group_by_value']]
+    argument_parser = argparse.ArgumentParser(description="Rank players by percentile of their stats against the server sample.")
+    argument_parser.add_argument('--set', dest='sets', action='append', default=[], help="comma-separated data files of a data set (repeatable, defaults to each category)")
+    argument_parser.add_argument('--stats', nargs='+', default=RANKED_STATS, choices=ranked_stat_ids, help="ranked stats")
+    argument_parser.add_argument('--rebuild', action='store_true', help="rebuild the baselines even if up to date")
+    arguments = argument_parser.parse_args()
+
+    data_options = dict(ui_utils.list_data_options(CATEGORIES_FOLDER, DATA_FOLDER))
+    data_sets_names = [data_set.split(',') for data_set in arguments.sets]
+    if not data_sets_names:
+        data_sets_names = [[name] for name, file in data_options.items() if os.path.dirname(file) == CATEGORIES_FOLDER]
+    for name in [name for data_set_names in data_sets_names for name in data_set_names]:
+        if name not in data_options:
+            argument_parser.error("unknown data file: {name}".format(name=name))
+    data_sets_files = [[data_options[name] for name in data_set_names] for data_set_names in data_sets_names]
+    return data_sets_names, data_sets_files, arguments.stats, arguments.rebuild
+
+
+if __name__ == '__main__':
+    ui_utils.prepare_folders(DATA_FOLDER, CATEGORIES_FOLDER)
+    if not os.path.exists(SERVER_FILE):
+        print("The server sample {file} is missing, run the player_lister first.".format(file=os.path.abspath(SERVER_FILE)))
+        sys.exit()
+
+    if len(sys.argv) > 1:  # Batch mode
+        data_sets_names, data_sets_files, stat_ids, should_rebuild = parse_arguments()
+        profiler.APP_ID = ui_utils.load_app_id(CONFIG_FILE, profiler.APP_ID)
+        api_utils.load_api_urls(CONFIG_FILE)
+        timing_utils.enable_report(CONFIG_FILE)
+        run_ranking(data_sets_names, data_sets_files, stat_ids, should_rebuild)
+        sys.exit()
+
+    input("The module player_ranker ranks the players of the selected data sets "
+          "by percentile of their stats against the server sample registered by "
+          "the player_lister.\n"
+          "The sorted stats of the server sample are registered once and reused "
+          "until the sample changes, so that ranking any data set afterwards "
+          "only requires the stats of its own players.\n"
+          "A median percentile is printed for each data set and the percentile "
+          "of each player is registered in a CSV file.\n\n"
+          "Press ENTER to continue (or CTRL + C + ENTER to abort).\n")
+
+    profiler.APP_ID = ui_utils.load_app_id(CONFIG_FILE, profiler.APP_ID)
+    api_utils.load_api_urls(CONFIG_FILE)
+    timing_utils.enable_report(CONFIG_FILE)
+
+    data_sets_number = ui_utils.select_data_sets_number(1, 10)
+    data_sets_names, data_sets_files = [], []
+    for data_set_id in range(data_sets_number):
+        data_options = ui_utils.select_data_files(data_set_id, CATEGORIES_FOLDER, DATA_FOLDER)
+        data_sets_names.append([name for name, _ in data_options])
+        data_sets_files.append([file for _, file in data_options])
+    run_ranking(data_sets_names, data_sets_files, RANKED_STATS)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""Register periodic snapshots of the per-tank stats of players."""
+
+import csv
+
+import api_utils
+import snapshot_utils
+import timing_utils
+import ui_utils
+
+CONFIG_FILE = '../../res/config.txt'
+APP_ID = 'demo'
+DATA_FOLDER = '../../data'
+CATEGORIES_FOLDER = '{data_folder}/categories'.format(data_folder=DATA_FOLDER)
+SNAPSHOTS_FOLDER = snapshot_utils.SNAPSHOTS_FOLDER
+UNKNOWN_ID = -1
+
+
+def load_player_ids(data_file_paths):
+    """Load the list of registered player ids in given data files."""
+    print("Loading registered player ids from CSV files... ", end='', flush=True)
+    player_ids = {}
+    for data_file_path in data_file_paths:
+        with open(data_file_path, 'r', newline='') as csv_file:
+            csv_reader = csv.reader(csv_file, delimiter=',')
+            for _, player_id in csv_reader:
+                if player_id != str(UNKNOWN_ID):
+                    player_ids[player_id] = None
+    print("Done. Loaded a total of %d valid account ids." % len(player_ids))
+    return list(player_ids)
+
+
+if __name__ == '__main__':
+    input("The module player_snapshotter connects to the WG API to retrieve "
+          "the stats of each tank played by the players of the selected data "
+          "files and registers them as a dated snapshot.\n"
+          "Running it periodically (e.g. daily) allows the player_profiler to "
+          "compute the recent WN8 of players from the difference between two "
+          "snapshots, without any additional request.\n\n"
+          "Press ENTER to continue (or CTRL + C + ENTER to abort).\n")
+
+    APP_ID = ui_utils.load_app_id(CONFIG_FILE, APP_ID)
+    api_utils.load_api_urls(CONFIG_FILE)
+    timing_utils.enable_report(CONFIG_FILE)
+    ui_utils.prepare_folders(DATA_FOLDER, CATEGORIES_FOLDER, SNAPSHOTS_FOLDER)
+
+    data_options = ui_utils.select_data_files(0, CATEGORIES_FOLDER, DATA_FOLDER)
+    player_ids = load_player_ids([file for _, file in data_options])
+    snapshot_utils.take_snapshot(player_ids, APP_ID)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""Provide tools to store and compare per-tank snapshots of players."""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import api_utils
+
+SNAPSHOT_FIELD_LIST = [
+    'battles',
+    'damage_dealt',
+    'spotted',
+    'frags',
+    'dropped_capture_points',
+    'wins'
+]
+DATA_FOLDER = '../../data'
+SNAPSHOTS_FOLDER = '{data_folder}/snapshots'.format(data_folder=DATA_FOLDER)
+SNAPSHOT_FILE_FORMAT = '{snapshots_folder}/%d.npz'.format(snapshots_folder=SNAPSHOTS_FOLDER)
+TANK_ID_SPAN = 1 << 32  # Tank ids are packed with account ids in a single int64 key
+loaded_snapshots = {}
+
+
+def take_snapshot(player_ids, app_id='demo'):
+    """Fetch the per-tank stats of players and register them as a new snapshot."""
+    account_ids, tank_ids, tank_stats = [], [], []
+    for index, player_id in enumerate(player_ids):
+        for tank_data in fetch_tank_stats(player_id, app_id):
+            account_ids.append(int(player_id))
+            tank_ids.append(tank_data['tank_id'])
+            tank_stats.append([tank_data['all'][field] for field in SNAPSHOT_FIELD_LIST])
+        progress = (index + 1) / len(player_ids) * 100
+        sys.stdout.write("\rRequesting tank stats: %.2f %%" % progress)
+        sys.stdout.flush()
+    print()
+
+    print("Registering snapshot to file... ", end='', flush=True)
+    account_ids = np.array(account_ids, dtype=np.int64)
+    tank_ids = np.array(tank_ids, dtype=np.int64)
+    tank_stats = np.array(tank_stats, dtype=np.int64).reshape(-1, len(SNAPSHOT_FIELD_LIST))
+    order = np.argsort(account_ids * TANK_ID_SPAN + tank_ids)
+    snapshot_file_path = SNAPSHOT_FILE_FORMAT % int(time.time())
+    np.savez_compressed(
+        snapshot_file_path,
+        account_ids=account_ids[order],
+        tank_ids=tank_ids[order],
+        tank_stats=tank_stats[order]
+    )
+    print("Done. Registered %d tanks of %d accounts." % (len(order), len(np.unique(account_ids))))
+    return snapshot_file_path
+
+
+def fetch_tank_stats(player_id, app_id):
+    """Retrieve the stats of all tanks played by a player."""
+    payload = {
+        'application_id': app_id,
+        'account_id': player_id,
+        'fields': ','.join(['tank_id'] + ['all.%s' % field for field in SNAPSHOT_FIELD_LIST])
+    }
+    response_content = api_utils.request('tanks/stats', payload)
+
+    if response_content['status'] == 'ok':
+        return response_content['data'][str(player_id)] or []
+    return []
+
+
+def list_snapshots():
+    """List registered snapshots from the oldest to the most recent."""
+    snapshots = []
+    if os.path.isdir(SNAPSHOTS_FOLDER):
+        for file_name in os.listdir(SNAPSHOTS_FOLDER):
+            timestamp, extension = os.path.splitext(file_name)
+            if extension == '.npz' and timestamp.isdigit():
+                snapshots.append((int(timestamp), os.path.join(SNAPSHOTS_FOLDER, file_name)))
+    return sorted(snapshots)
+
+
+def load_snapshot(snapshot_file_path):
+    """Load a snapshot from file, once per run."""
+    if snapshot_file_path not in loaded_snapshots:
+        with np.load(snapshot_file_path) as snapshot_file:
+            account_ids, tank_ids = snapshot_file['account_ids'], snapshot_file['tank_ids']
+            loaded_snapshots[snapshot_file_path] = {
+                'keys': account_ids * TANK_ID_SPAN + tank_ids,
+                'account_ids': account_ids,
+                'tank_ids': tank_ids,
+                'tank_stats': snapshot_file['tank_stats']
+            }
+    return loaded_snapshots[snapshot_file_path]
+
+
+def get_total_battles(snapshot, account_ids):
+    """Sum the battles of each account in a snapshot, or -1 if absent from it."""
+    unique_ids = np.unique(snapshot['account_ids'])
+    positions = np.searchsorted(unique_ids, snapshot['account_ids'])
+    battles = np.bincount(positions, weights=snapshot['tank_stats'][:, 0], minlength=len(unique_ids))
+    total_battles = np.full(len(account_ids), -1, dtype=np.int64)
+    if len(unique_ids) > 0:
+        found_positions = np.minimum(np.searchsorted(unique_ids, account_ids), len(unique_ids) - 1)
+        found = unique_ids[found_positions] == account_ids
+        total_battles[found] = battles[found_positions[found]]
+    return total_battles
+
+
+def diff_snapshots(new_snapshot, old_snapshot, account_ids):
+    """Compute the per-tank stats gained by accounts between two snapshots."""
+    rows = np.isin(new_snapshot['account_ids'], account_ids)
+    keys = new_snapshot['keys'][rows]
+    new_stats = new_snapshot['tank_stats'][rows]
+    old_stats = np.zeros_like(new_stats)
+    if len(old_snapshot['keys']) > 0:
+        old_positions = np.minimum(np.searchsorted(old_snapshot['keys'], keys), len(old_snapshot['keys']) - 1)
+        found = old_snapshot['keys'][old_positions] == keys
+        old_stats[found] = old_snapshot['tank_stats'][old_positions[found]]
+    delta_stats = np.maximum(new_stats - old_stats, 0)  # Stats of reset tanks are not negative
+    player_indexes = np.searchsorted(account_ids, new_snapshot['account_ids'][rows])
+    return player_indexes, new_snapshot['tank_ids'][rows], delta_stats
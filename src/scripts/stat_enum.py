@@ -6,10 +6,10 @@ import player_profiler as profiler
 
 STATS = {
     'battles': {
-        'stats_fetcher': profiler.get_total_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "battles",
         'long_name': "battle count",
-        'field': 'statistics.all.battles',
+        'expression': 'statistics.all.battles',
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -30,11 +30,23 @@ STATS = {
         'mark_step_hist': 500,
         'mark_step_curve': 100
     },
+    'recent_wn8': {
+        'stats_fetcher': profiler.get_recent_wn8_d,
+        'short_name': "recent WN8",
+        'long_name': "recent WN8",
+        'use_exp_values': True,
+        'group_by_value': False,
+        'is_percentage': False,
+        'preferred_lb': 0,
+        'preferred_ub': 3500,
+        'mark_step_hist': 500,
+        'mark_step_curve': 100
+    },
     'global_rating': {
-        'stats_fetcher': profiler.get_total_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "global rating",
         'long_name': "global rating",
-        'field': 'global_rating',
+        'expression': 'global_rating',
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -44,11 +56,11 @@ STATS = {
         'mark_step_curve': 100
     },
     'wr': {
-        'stats_fetcher': profiler.get_average_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "WR",
         'long_name': "win ratio",
-        'field': 'statistics.all.wins',
-        'dependency_field': 'statistics.all.battles',
+        'expression': 'statistics.all.wins / statistics.all.battles * 100',
+        'positive_only': True,
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': True,
@@ -58,10 +70,10 @@ STATS = {
         'mark_step_curve': 1
     },
     'avg_xp': {
-        'stats_fetcher': profiler.get_total_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "average xp",
         'long_name': "average experience points",
-        'field': 'statistics.all.battle_avg_xp',
+        'expression': 'statistics.all.battle_avg_xp',
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -71,11 +83,11 @@ STATS = {
         'mark_step_curve': 10
     },
     'avg_damage': {
-        'stats_fetcher': profiler.get_average_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "average damage",
         'long_name': "average damage dealt",
-        'field': 'statistics.all.damage_dealt',
-        'dependency_field': 'statistics.all.battles',
+        'expression': 'statistics.all.damage_dealt / statistics.all.battles',
+        'positive_only': True,
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -85,10 +97,10 @@ STATS = {
         'mark_step_curve': 30
     },
     'avg_assist': {
-        'stats_fetcher': profiler.get_total_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "average assist",
         'long_name': "average damage assisted",
-        'field': 'statistics.all.avg_damage_assisted',
+        'expression': 'statistics.all.avg_damage_assisted',
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -98,10 +110,10 @@ STATS = {
         'mark_step_curve': 10
     },
     'avg_blocked': {
-        'stats_fetcher': profiler.get_total_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "average blocked",
         'long_name': "average damage blocked",
-        'field': 'statistics.all.avg_damage_blocked',
+        'expression': 'statistics.all.avg_damage_blocked',
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -111,11 +123,11 @@ STATS = {
         'mark_step_curve': 10
     },
     'avg_kill': {
-        'stats_fetcher': profiler.get_average_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "average kill",
         'long_name': "average vehicles destroyed",
-        'field': 'statistics.all.frags',
-        'dependency_field': 'statistics.all.battles',
+        'expression': 'statistics.all.frags / statistics.all.battles',
+        'positive_only': True,
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -125,11 +137,11 @@ STATS = {
         'mark_step_curve': 1
     },
     'avg_spot': {
-        'stats_fetcher': profiler.get_average_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "average spot",
         'long_name': "average vehicles spotted",
-        'field': 'statistics.all.spotted',
-        'dependency_field': 'statistics.all.battles',
+        'expression': 'statistics.all.spotted / statistics.all.battles',
+        'positive_only': True,
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -139,11 +151,11 @@ STATS = {
         'mark_step_curve': 1
     },
     'hit_ratio': {
-        'stats_fetcher': profiler.get_per_shot_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "hit ratio",
         'long_name': "direct hit ratio",
-        'field': 'statistics.all.hits',
-        'dependency_field': 'statistics.all.shots',
+        'expression': 'statistics.all.hits / statistics.all.shots * 100',
+        'positive_only': True,
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': True,
@@ -153,11 +165,11 @@ STATS = {
         'mark_step_curve': 1
     },
     'avg_capture': {
-        'stats_fetcher': profiler.get_average_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "average capture",
         'long_name': "average capture points",
-        'field': 'statistics.all.capture_points',
-        'dependency_field': 'statistics.all.battles',
+        'expression': 'statistics.all.capture_points / statistics.all.battles',
+        'positive_only': True,
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -167,11 +179,11 @@ STATS = {
         'mark_step_curve': 1
     },
     'avg_defense': {
-        'stats_fetcher': profiler.get_average_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "average defense",
         'long_name': "average defense points",
-        'field': 'statistics.all.dropped_capture_points',
-        'dependency_field': 'statistics.all.battles',
+        'expression': 'statistics.all.dropped_capture_points / statistics.all.battles',
+        'positive_only': True,
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': False,
@@ -181,11 +193,11 @@ STATS = {
         'mark_step_curve': 1
     },
     'splash_ratio': {
-        'stats_fetcher': profiler.get_average_stat_d,
+        'stats_fetcher': profiler.get_expression_stat_d,
         'short_name': "splash ratio",
         'long_name': "splash received ratio",
-        'field': 'statistics.all.explosion_hits',
-        'dependency_field': 'statistics.all.battles',
+        'expression': 'statistics.all.explosion_hits / statistics.all.battles * 100',
+        'positive_only': True,
         'use_exp_values': False,
         'group_by_value': False,
         'is_percentage': True,
@@ -194,6 +206,61 @@ STATS = {
         'mark_step_hist': 5,
         'mark_step_curve': 1
     },
+    'damage_ratio': {
+        'stats_fetcher': profiler.get_expression_stat_d,
+        'short_name': "damage ratio",
+        'long_name': "damage dealt to received ratio",
+        'expression': 'statistics.all.damage_dealt / statistics.all.damage_received',
+        'positive_only': True,
+        'use_exp_values': False,
+        'group_by_value': False,
+        'is_percentage': False,
+        'preferred_lb': 0,
+        'preferred_ub': 3,
+        'mark_step_hist': 1,
+        'mark_step_curve': 1
+    },
+    'survival_rate': {
+        'stats_fetcher': profiler.get_expression_stat_d,
+        'short_name': "survival rate",
+        'long_name': "survival rate",
+        'expression': 'statistics.all.survived_battles / statistics.all.battles * 100',
+        'positive_only': True,
+        'use_exp_values': False,
+        'group_by_value': False,
+        'is_percentage': True,
+        'preferred_lb': 10,
+        'preferred_ub': 60,
+        'mark_step_hist': 5,
+        'mark_step_curve': 1
+    },
+    'kd_ratio': {
+        'stats_fetcher': profiler.get_expression_stat_d,
+        'short_name': "K/D",
+        'long_name': "kill to death ratio",
+        'expression': 'statistics.all.frags / (statistics.all.battles - statistics.all.survived_battles)',
+        'positive_only': True,
+        'use_exp_values': False,
+        'group_by_value': False,
+        'is_percentage': False,
+        'preferred_lb': 0,
+        'preferred_ub': 3,
+        'mark_step_hist': 1,
+        'mark_step_curve': 1
+    },
+    'created_at': {
+        'stats_fetcher': profiler.get_expression_stat_d,
+        'short_name': "creation time",
+        'long_name': "account creation timestamp",
+        'expression': 'created_at',
+        'use_exp_values': False,
+        'group_by_value': False,
+        'is_percentage': False,
+        'preferred_lb': 0,
+        'preferred_ub': 0,
+        'mark_step_hist': 30 * 24 * 3600,
+        'mark_step_curve': 30 * 24 * 3600
+    },
     'count': {
         'stats_fetcher': profiler.get_count_d,
         'short_name': "count",
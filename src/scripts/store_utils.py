@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""Provide compact stores of the account fields fetched while listing accounts."""
+
+import os
+import time
+
+import numpy as np
+
+import expression_utils
+
+DATA_FOLDER = '../../data'
+STORES_FOLDER = '{data_folder}/stores'.format(data_folder=DATA_FOLDER)  # Outside of data folders listed as data sets
+STORE_FILE_FORMAT = '{stores_folder}/%s.npz'.format(stores_folder=STORES_FOLDER)
+loaded_stores = {}
+
+
+def get_store_fields(expressions):
+    """Get the fields required to evaluate the given stat expressions."""
+    fields = []
+    for expression in expressions:
+        for field in expression_utils.compile_expression(expression)['fields']:
+            if field not in fields:
+                fields.append(field)
+    return fields
+
+
+def build_store(fields, player_ids=(), players_data=()):
+    """Build a store of the fields of a batch of players, fetched now, with one float64 value per player and field."""
+    values = np.column_stack(expression_utils.get_columns(fields, players_data)) if len(players_data) > 0 else np.zeros((0, len(fields)))
+    return {
+        'fields': list(fields),
+        'player_ids': np.asarray(player_ids, dtype=np.int64),
+        'fetched_at': np.full(len(player_ids), int(time.time()), dtype=np.int64),
+        'values': values.reshape(len(player_ids), len(fields))
+    }
+
+
+def merge_stores(stores):
+    """Merge stores of the same fields, keeping the most recently fetched row of each player, sorted by id."""
+    stores = [store for store in stores if store['fields'] == stores[-1]['fields']]
+    player_ids = np.concatenate([store['player_ids'] for store in stores])
+    fetched_at = np.concatenate([store['fetched_at'] for store in stores])
+    values = np.concatenate([store['values'] for store in stores])
+    rows = np.lexsort((-fetched_at, player_ids))
+    rows = rows[np.concatenate(([True], player_ids[rows][1:] != player_ids[rows][:-1]))] if len(rows) > 0 else rows
+    return {'fields': stores[-1]['fields'], 'player_ids': player_ids[rows], 'fetched_at': fetched_at[rows], 'values': values[rows]}
+
+
+def save_store(store, file_path):
+    """Register a store to file."""
+    np.savez(file_path, **store)
+
+
+def load_store(file_path):
+    """Load a store from file, once per run, or None if missing."""
+    if file_path not in loaded_stores:
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as store_file:
+            loaded_stores[file_path] = {key: store_file[key] for key in store_file.files}
+        loaded_stores[file_path]['fields'] = loaded_stores[file_path]['fields'].tolist()
+    return loaded_stores[file_path]
+
+
+def get_stored_columns(store, fields, player_ids, max_age=None):
+    """Get the ids of the given players found in the store, fetched recently enough, along with the columns of their fields."""
+    player_ids = np.asarray(player_ids, dtype=np.int64)
+    if len(store['player_ids']) == 0:
+        return player_ids[:0], [np.zeros(0) for field in fields]
+    rows = np.minimum(np.searchsorted(store['player_ids'], player_ids), len(store['player_ids']) - 1)
+    is_found = store['player_ids'][rows] == player_ids
+    if max_age is not None:
+        is_found &= store['fetched_at'][rows] >= time.time() - max_age
+    rows = rows[is_found]
+    field_indexes = [store['fields'].index(field) for field in fields]
+    return player_ids[is_found], [store['values'][rows, field_index] for field_index in field_indexes]
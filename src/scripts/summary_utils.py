@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Provide compact histogram summaries of player stats."""
+
+import os
+import time
+
+import numpy as np
+
+
+def build_summary(stats, bin_width):
+    """Summarize stats in a fixed-resolution histogram along with their min, max, count, sum and squared sum."""
+    summary = {
+        'bin_width': float(bin_width),
+        'offset': 0,
+        'counts': np.zeros(0, dtype=np.int64),
+        'min': float('inf'),
+        'max': float('-inf'),
+        'count': 0,
+        'sum': 0.0,
+        'sumsq': 0.0,
+        'timestamp': int(time.time())
+    }
+    return update_summary(summary, stats)
+
+
+def update_summary(summary, stats):
+    """Add stats to a summary in place, extending its bins if needed, so that it can be fed by batches."""
+    stats = np.asarray(stats, dtype=np.float64)
+    if len(stats) == 0:
+        return summary
+    bin_indexes = np.floor(stats / summary['bin_width']).astype(np.int64)
+    if summary['count'] > 0:
+        lower_bin, upper_bin = min(summary['offset'], bin_indexes.min()), max(summary['offset'] + len(summary['counts']), bin_indexes.max() + 1)
+    else:
+        lower_bin, upper_bin = bin_indexes.min(), bin_indexes.max() + 1
+    counts = np.bincount(bin_indexes - lower_bin, minlength=upper_bin - lower_bin)
+    counts[summary['offset'] - lower_bin:summary['offset'] - lower_bin + len(summary['counts'])] += summary['counts']
+    summary['offset'], summary['counts'] = int(lower_bin), counts
+    summary['min'], summary['max'] = min(summary['min'], float(stats.min())), max(summary['max'], float(stats.max()))
+    summary['count'] += len(stats)
+    summary['sum'] += float(stats.sum())
+    summary['sumsq'] += float((stats ** 2).sum())
+    summary['timestamp'] = int(time.time())
+    return summary
+
+
+def get_quantile(summary, quantile):
+    """Estimate the stat below which lies the given fraction of the summarized stats, interpolated within its bin."""
+    if summary['count'] == 0:
+        return float('nan')
+    cumulative_counts = np.cumsum(summary['counts'])
+    target_count = quantile * summary['count']
+    bin_index = min(int(np.searchsorted(cumulative_counts, target_count, side='left')), len(cumulative_counts) - 1)
+    bin_count = summary['counts'][bin_index]
+    fraction = (target_count - (cumulative_counts[bin_index] - bin_count)) / bin_count if bin_count > 0 else 0
+    stat = (summary['offset'] + bin_index + fraction) * summary['bin_width']
+    return min(max(float(stat), summary['min']), summary['max'])
+
+
+def rebin_summary(summary, bin_edges):
+    """Count the summarized stats in each bin delimited by given edges, the last bin being closed."""
+    bin_count = len(bin_edges) - 1
+    fine_bin_starts = (summary['offset'] + np.arange(len(summary['counts']))) * summary['bin_width']
+    bin_indexes = np.digitize(fine_bin_starts + summary['bin_width'] / 2, bin_edges) - 1
+    bin_indexes[np.isclose(fine_bin_starts, bin_edges[-1])] = bin_count - 1  # Stats equal to the upper bound
+    in_bins = (bin_indexes >= 0) & (bin_indexes < bin_count)
+    return np.bincount(bin_indexes[in_bins], weights=summary['counts'][in_bins], minlength=bin_count)
+
+
+def save_summary(summary, file_path):
+    """Register a summary to file."""
+    np.savez(file_path, **summary)
+
+
+def load_summary(file_path, max_age=None):
+    """Load a summary from file, unless missing or older than the given age in seconds."""
+    if not os.path.exists(file_path):
+        return None
+    with np.load(file_path) as summary_file:
+        summary = {key: summary_file[key] for key in summary_file.files}
+    for key in summary:
+        if key != 'counts':
+            summary[key] = summary[key].item()
+    if max_age is not None and time.time() - summary['timestamp'] > max_age:
+        return None
+    return summary
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""Provide columnar tables of player stats, with one row per account id."""
+
+import numpy as np
+
+
+def build_table():
+    """Build an empty table of sorted account ids, stat columns (NaN if missing) and per stat fetch flags."""
+    return {
+        'player_ids': np.zeros(0, dtype=np.int64),
+        'columns': {},  # Float stats, or codes of the labels of stats grouped by value
+        'fetched': {},
+        'labels': {}
+    }
+
+
+def to_player_ids(player_ids):
+    """Convert account ids, as strings or integers, to an array of int64 ids."""
+    return np.asarray(player_ids, dtype=np.int64)
+
+
+def add_players(table, player_ids):
+    """Add rows for the account ids not yet in the table, keeping rows sorted by id."""
+    new_player_ids = np.setdiff1d(to_player_ids(player_ids), table['player_ids'])
+    if len(new_player_ids) == 0:
+        return
+    merged_player_ids = np.union1d(table['player_ids'], new_player_ids)
+    old_rows = np.searchsorted(merged_player_ids, table['player_ids'])
+    for stat_name, column in table['columns'].items():
+        table['columns'][stat_name] = np.full(len(merged_player_ids), np.nan, dtype=np.float64)
+        table['columns'][stat_name][old_rows] = column
+    for stat_name, fetched in table['fetched'].items():
+        table['fetched'][stat_name] = np.zeros(len(merged_player_ids), dtype=bool)
+        table['fetched'][stat_name][old_rows] = fetched
+    table['player_ids'] = merged_player_ids
+
+
+def get_rows(table, player_ids):
+    """Get the row of each account id, which must already be in the table."""
+    return np.searchsorted(table['player_ids'], to_player_ids(player_ids))
+
+
+def get_unfetched_player_ids(table, stat_name, player_ids):
+    """Get the account ids whose stat has not been fetched yet, as int64 ids in table order."""
+    add_players(table, player_ids)
+    rows = np.unique(get_rows(table, player_ids))
+    if stat_name not in table['fetched']:
+        return table['player_ids'][rows]
+    return table['player_ids'][rows[~table['fetched'][stat_name][rows]]]
+
+
+def add_column(table, stat_name):
+    """Add an empty column for a stat, if not already in the table."""
+    if stat_name not in table['columns']:
+        table['columns'][stat_name] = np.full(len(table['player_ids']), np.nan, dtype=np.float64)
+        table['fetched'][stat_name] = np.zeros(len(table['player_ids']), dtype=bool)
+
+
+def set_stat_array(table, stat_name, player_ids, stats):
+    """Register the stats of a batch of fetched players, given as an array aligned with their ids, NaN for players without stat."""
+    add_players(table, player_ids)
+    add_column(table, stat_name)
+    rows = get_rows(table, player_ids)
+    table['fetched'][stat_name][rows] = True
+    table['columns'][stat_name][rows] = stats
+
+
+def set_stats(table, stat_name, player_ids, stats_d, is_label=False):
+    """Register the stats of a batch of fetched players, given by account id and missing for players without stat."""
+    add_players(table, player_ids)
+    add_column(table, stat_name)
+    table['fetched'][stat_name][get_rows(table, player_ids)] = True
+    stats_d = {player_id: stat for player_id, stat in stats_d.items() if stat is not None}
+    if not stats_d:
+        return
+    stats = list(stats_d.values())
+    if is_label:  # Labels stored as codes
+        labels = table['labels'].setdefault(stat_name, [])
+        for stat in set(stats).difference(labels):
+            labels.append(stat)
+        label_codes = {label: code for code, label in enumerate(labels)}
+        stats = [label_codes[stat] for stat in stats]
+    table['columns'][stat_name][get_rows(table, list(stats_d))] = stats
+
+
+def get_stats(table, stat_name, player_ids):
+    """Get the stats of players as a float64 array aligned with the account ids, NaN where missing."""
+    if stat_name not in table['columns']:
+        return np.full(len(player_ids), np.nan, dtype=np.float64)
+    return table['columns'][stat_name][get_rows(table, player_ids)]
+
+
+def get_labels(table, stat_name, player_ids):
+    """Get the labels of players as an object array aligned with the account ids, None where missing."""
+    labels = np.array(table['labels'].get(stat_name, []) + [None], dtype=object)
+    label_codes = get_stats(table, stat_name, player_ids)
+    return labels[np.where(np.isnan(label_codes), -1, label_codes).astype(np.int64)]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""Measure the time spent in each stage of the scripts and report it at exit."""
+
+import time
+import atexit
+import cProfile
+import threading
+import contextlib
+
+import ui_utils
+
+REPORT_CONFIG_KEY = 'TIMING_REPORT'  # Print the stage breakdown at exit if set to 1
+PROFILE_CONFIG_KEY = 'PROFILE_FILE'  # Dump a cProfile of the run to this file if set
+START_TIME = time.perf_counter()
+stage_d = {}
+counter_d = {}
+lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def stage(name, items=0):
+    """Time a stage of the script, optionally along with the number of items it processed."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - start, items)
+
+
+def add_stage_time(name, seconds, items=0):
+    """Register the duration of one call to a stage."""
+    with lock:
+        if name not in stage_d:
+            stage_d[name] = {'calls': 0, 'seconds': 0.0, 'items': 0}
+        stage_d[name]['calls'] += 1
+        stage_d[name]['seconds'] += seconds
+        stage_d[name]['items'] += items
+
+
+def count(name, amount=1):
+    """Increase a counter, e.g. of requests, received bytes or cache hits."""
+    with lock:
+        counter_d[name] = counter_d.get(name, 0) + amount
+
+
+def take_totals():
+    """Take the stage totals and counters registered so far and reset them, e.g. to send them from a worker process."""
+    with lock:
+        totals = dict(stage_d), dict(counter_d)
+        stage_d.clear()
+        counter_d.clear()
+    return totals
+
+
+def merge_totals(stage_totals, counter_totals):
+    """Add the stage totals and counters taken in another process, e.g. a worker process, to those of this process."""
+    with lock:
+        for name, stage_stats in stage_totals.items():
+            if name not in stage_d:
+                stage_d[name] = {'calls': 0, 'seconds': 0.0, 'items': 0}
+            for key in ('calls', 'seconds', 'items'):
+                stage_d[name][key] += stage_stats[key]
+        for name, value in counter_totals.items():
+            counter_d[name] = counter_d.get(name, 0) + value
+
+
+def enable_report(config_file):
+    """Print the stage breakdown and dump a cProfile of the run at exit, if enabled in config."""
+    if ui_utils.load_config_value(config_file, REPORT_CONFIG_KEY) in ('1', 'true', 'yes'):
+        atexit.register(print_report)
+    profile_file_path = ui_utils.load_config_value(config_file, PROFILE_CONFIG_KEY)
+    if profile_file_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        atexit.register(dump_profile, profiler, profile_file_path)
+
+
+def print_report():
+    """Print the time spent in each stage and the throughput of the run."""
+    wall_seconds = time.perf_counter() - START_TIME
+    print("\nTiming report ({seconds:.2f} s in total, stages may be nested):".format(seconds=wall_seconds))
+    print("  {:<24}{:>8}{:>12}{:>9}{:>10}{:>12}".format("stage", "calls", "seconds", "share", "items", "items/s"))
+    for name, stage_stats in sorted(stage_d.items(), key=lambda item: item[1]['seconds'], reverse=True):
+        items_per_second = stage_stats['items'] / stage_stats['seconds'] if stage_stats['items'] and stage_stats['seconds'] > 0 else 0
+        print("  {:<24}{:>8}{:>12.3f}{:>8.1f}%{:>10}{:>12}".format(
+            name, stage_stats['calls'], stage_stats['seconds'], stage_stats['seconds'] / wall_seconds * 100,
+            stage_stats['items'] or '', "%.1f" % items_per_second if items_per_second else ''
+        ))
+    if 'requests' in counter_d:
+        print("  {requests} requests ({rate:.1f}/s), {size:.2f} MB received".format(
+            requests=counter_d['requests'], rate=counter_d['requests'] / wall_seconds,
+            size=counter_d.get('bytes received', 0) / 2 ** 20
+        ))
+    for name, value in sorted(counter_d.items()):
+        if name not in ('requests', 'bytes received'):
+            print("  {name}: {value}".format(name=name, value=value))
+
+
+def dump_profile(profiler, profile_file_path):
+    """Register the cProfile of the run, to be browsed with pstats or turned into a flame graph (e.g. with flameprof)."""
+    profiler.disable()
+    profiler.dump_stats(profile_file_path)
+    print("Profile of the run registered to {file}.".format(file=profile_file_path))
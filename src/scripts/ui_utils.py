@@ -25,6 +25,17 @@ def load_app_id(config_file, default_app_id):
     return app_id
 
 
+def load_config_value(config_file, key):
+    """Load the value of an optional key from config, or None if not set."""
+    if os.path.exists(config_file):
+        with open(config_file, 'r') as config:
+            for config_line in config:
+                config_key, separator, value = config_line.rstrip().partition('=')
+                if separator and config_key.strip() == key and value.strip():
+                    return value.strip()
+    return None
+
+
 def prepare_folders(*folders, clean=False):
     """Create the folders if not already done."""
     for folder in folders:
@@ -83,6 +94,16 @@ def select_offset_option(*offset_options):
     )
 
 
+def select_store_option(*store_options):
+    """Prompt a menu for the selection of the store option."""
+    return select_simple_option(
+        store_options,
+        "Should the stats of listed accounts be stored so that the player_profiler does not fetch them again ?",
+        "store option",
+        1
+    )
+
+
 def select_filters(available_filters):
     """Prompt a menu for the selection of filters."""
     filter_selection, selected_filters = -1, []
@@ -147,6 +168,16 @@ def select_repair_option(*repair_options):
     )
 
 
+def select_update_option(*update_options):
+    """Prompt a menu for the selection of the update option."""
+    return select_simple_option(
+        update_options,
+        "Should only image files modified since the previous run be categorized again ?",
+        "update option",
+        1
+    )
+
+
 def select_category_option(*category_options):
     """Prompt a menu for the selection of the category option."""
     return select_simple_option(
@@ -203,13 +234,19 @@ def select_data_sets_number(min_data_sets=1, max_data_sets=1):
     return data_sets_number
 
 
-def select_data_files(data_set_id, categories_folder, extras_folder):
-    """Prompt a menu for the selection of data files."""
-    categories_files = [os.path.join(categories_folder, file_name) for file_name in os.listdir(categories_folder)]
-    extra_files = [os.path.join(extras_folder, file_name) for file_name in os.listdir(extras_folder)]
+def list_data_options(categories_folder, extras_folder):
+    """List the names and paths of available data files."""
+    # Other files, e.g. category files left partly written by an interrupted run, are not data sets
+    categories_files = [os.path.join(categories_folder, file_name) for file_name in os.listdir(categories_folder) if file_name.endswith('.csv')]
+    extra_files = [os.path.join(extras_folder, file_name) for file_name in os.listdir(extras_folder) if file_name.endswith('.csv')]
     categories = [(os.path.splitext(os.path.basename(file))[0], file) for file in categories_files if os.path.isfile(file)]
     extras = [(os.path.splitext(os.path.basename(file))[0], file) for file in extra_files if os.path.isfile(file)]
-    data_options = categories + extras
+    return categories + extras
+
+
+def select_data_files(data_set_id, categories_folder, extras_folder):
+    """Prompt a menu for the selection of data files."""
+    data_options = list_data_options(categories_folder, extras_folder)
     data_option_selection, data_files = -1, []
     print("Select one or several data files to include to the data set # %d." % (data_set_id + 1))
     print("  {number} : {name}".format(number=0, name="Finish selection"))
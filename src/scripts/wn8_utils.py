@@ -5,12 +5,13 @@
 import os
 import json
 
+import numpy as np
 import requests
 
+import api_utils
+import snapshot_utils
+import timing_utils
 
-ACCOUNT_STATS_REQUEST_URL = 'https://api.worldoftanks.eu/wot/account/info/'
-ACCOUNT_TANKS_REQUEST_URL = 'https://api.worldoftanks.eu/wot/account/tanks/'
-TANK_STATS_REQUEST_URL = 'https://api.worldoftanks.eu/wot/tanks/stats/'
 BATCH_SIZE = 100
 ACCOUNT_STATS_FIELD_LIST = [
     'statistics.all.battles',
@@ -31,41 +32,111 @@ TANK_STATS_FIELD_LIST = [
     'all.dropped_capture_points',
     'all.wins'
 ]
-EXP_VALUES_FILE_URL = 'https://static.modxvm.com/wn8-data-exp/json/wn8exp.json'
 RES_FOLDER = '../../res'
-EXP_VALUES_FILE_PATH = '{folder}/wn8_exp_values.json'.format(folder=RES_FOLDER)
+EXP_VALUES_FILE_PATH = '{folder}/wn8_exp_values.json'.format(folder=RES_FOLDER)  # Legacy raw download
+EXP_VALUES_FOLDER = '{folder}/wn8_exp_values'.format(folder=RES_FOLDER)
+EXP_VALUES_META_FILE_PATH = '{folder}/meta.json'.format(folder=EXP_VALUES_FOLDER)
+EXP_VALUES_TABLE_FILE_FORMAT = '{folder}/%s.npz'.format(folder=EXP_VALUES_FOLDER)
+EXP_VALUES_KEPT_VERSIONS = 5
+EXP_VALUES_COLUMNS = ['damage_ratio', 'spot_ratio', 'kill_ratio', 'defense_ratio', 'win_ratio']
+RECENT_WINDOW_DAYS = 30
+exp_values_cache = {}
+reported_short_windows = set()
 
 
 def get_exp_values_d():
-    """Download or load the last version of WN8 expected values."""
-    if not os.path.isdir(RES_FOLDER):
-        os.makedirs(RES_FOLDER)
+    """Load the last version of WN8 expected values, once per run."""
+    if 'exp_values_d' not in exp_values_cache:
+        exp_tank_ids, exp_values = get_exp_values_table()
+        exp_values_cache['exp_values_d'] = {
+            int(tank_id): dict(zip(EXP_VALUES_COLUMNS, tank_exp_values.tolist()))
+            for tank_id, tank_exp_values in zip(exp_tank_ids, exp_values)
+        }
+    return exp_values_cache['exp_values_d']
+
+
+def get_exp_values_table():
+    """Refresh and load the table of WN8 expected values, sorted by tank id."""
+    if 'table' not in exp_values_cache:
+        if not os.path.isdir(EXP_VALUES_FOLDER):
+            os.makedirs(EXP_VALUES_FOLDER)
+        meta = refresh_exp_values(load_exp_values_meta())
+
+        exp_tank_ids, exp_values = np.zeros(0, dtype=np.int64), np.zeros((0, len(EXP_VALUES_COLUMNS)))
+        if meta.get('version'):
+            with np.load(EXP_VALUES_TABLE_FILE_FORMAT % meta['version']) as table_file:
+                exp_tank_ids, exp_values = table_file['tank_ids'], table_file['values']
+        exp_values_cache['table'] = exp_tank_ids, exp_values
+    return exp_values_cache['table']
+
+
+def load_exp_values_meta():
+    """Load the version and cache validators of the current expected values table."""
+    meta = {}
+    if os.path.exists(EXP_VALUES_META_FILE_PATH):
+        with open(EXP_VALUES_META_FILE_PATH, 'r') as meta_file:
+            meta = json.load(meta_file)
+    if meta.get('version') and not os.path.exists(EXP_VALUES_TABLE_FILE_FORMAT % meta['version']):
+        meta = {}
+    return meta
+
+
+def refresh_exp_values(meta):
+    """Download the expected values if they were modified since the last download."""
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
 
     exp_values_json = None
-    if not os.path.exists(EXP_VALUES_FILE_PATH):
-        response = requests.get(EXP_VALUES_FILE_URL)
-        with open(EXP_VALUES_FILE_PATH, 'w') as exp_values_file:
-            exp_values_file.write(response.text)
+    try:
+        response = requests.get(api_utils.EXP_VALUES_FILE_URL, headers=headers, timeout=30)
+        if response.status_code == 200:
             exp_values_json = response.json()
-    else:
-        with open(EXP_VALUES_FILE_PATH, 'r') as exp_values_file:
-            exp_values_json = json.load(exp_values_file)
+            meta['etag'] = response.headers.get('ETag')
+            meta['last_modified'] = response.headers.get('Last-Modified')
+    except (requests.RequestException, ValueError):
+        print("Could not check for new WN8 expected values, using the last downloaded version.")
+        if not meta.get('version') and os.path.exists(EXP_VALUES_FILE_PATH):
+            with open(EXP_VALUES_FILE_PATH, 'r') as exp_values_file:
+                exp_values_json = json.load(exp_values_file)
 
-    exp_values_d = {}
     if exp_values_json:
-        for tank_data in exp_values_json['data']:
-            exp_values_d[tank_data['IDNum']] = {
-                'damage_ratio': tank_data['expDamage'],
-                'spot_ratio': tank_data['expSpot'],
-                'kill_ratio': tank_data['expFrag'],
-                'defense_ratio': tank_data['expDef'],
-                'win_ratio': tank_data['expWinRate']
-            }
-    return exp_values_d
+        header = exp_values_json.get('header', {})
+        version = str(header.get('version', '')) or meta.get('etag') or 'legacy'
+        meta['version'] = ''.join(char for char in version if char.isalnum() or char in '-_.')
+        exp_tank_ids = np.array([tank_data['IDNum'] for tank_data in exp_values_json['data']], dtype=np.int64)
+        exp_values = np.array([[
+            tank_data['expDamage'],
+            tank_data['expSpot'],
+            tank_data['expFrag'],
+            tank_data['expDef'],
+            tank_data['expWinRate']
+        ] for tank_data in exp_values_json['data']], dtype=np.float64).reshape(-1, len(EXP_VALUES_COLUMNS))
+        order = np.argsort(exp_tank_ids)
+        np.savez(EXP_VALUES_TABLE_FILE_FORMAT % meta['version'], tank_ids=exp_tank_ids[order], values=exp_values[order])
+        with open(EXP_VALUES_META_FILE_PATH, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        prune_exp_values_tables(meta['version'])
+    return meta
+
+
+def prune_exp_values_tables(current_version):
+    """Remove the oldest versions of the expected values tables."""
+    table_file_paths = [
+        os.path.join(EXP_VALUES_FOLDER, file_name)
+        for file_name in os.listdir(EXP_VALUES_FOLDER) if file_name.endswith('.npz')
+    ]
+    table_file_paths.sort(key=os.path.getmtime, reverse=True)
+    current_table_file_path = os.path.normpath(EXP_VALUES_TABLE_FILE_FORMAT % current_version)
+    for table_file_path in table_file_paths[EXP_VALUES_KEPT_VERSIONS:]:
+        if os.path.normpath(table_file_path) != current_table_file_path:
+            os.remove(table_file_path)
 
 
 def calculate_wn8(player_ids, exp_values_d, app_id='demo'):
-    """Calculate the WN8 of a batch of players."""
+    """Calculate the WN8 of a batch of players, or None if the stats of some of them could not be fetched."""
     wn8_d, account_stats_d, exp_stats_d = {}, {}, {}
     missing_tanks_d = {player_id: [] for player_id in player_ids}
 
@@ -73,47 +144,150 @@ def calculate_wn8(player_ids, exp_values_d, app_id='demo'):
     while index < len(player_ids):
         batches.append(player_ids[index:min(index + BATCH_SIZE, len(player_ids))])
         index += len(batches[-1])
-    for batch in batches:
-        load_account_stats(account_stats_d, batch, app_id)
-        load_expected_stats(exp_stats_d, missing_tanks_d, batch, exp_values_d, app_id)
+    with timing_utils.stage('wn8 fetch', len(player_ids)):
+        for batch in batches:
+            if not load_account_stats(account_stats_d, batch, app_id):
+                return None
+            if not load_expected_stats(exp_stats_d, missing_tanks_d, batch, exp_values_d, app_id):
+                return None
+        for player_id in player_ids:
+            if all(player_id in stats for stats in (account_stats_d, exp_stats_d)):
+                adjust_account_stats(account_stats_d, player_id, missing_tanks_d[player_id], app_id)
 
-    for player_id in player_ids:
-        if all(player_id in stats for stats in (account_stats_d, exp_stats_d)):
-            adjust_account_stats(account_stats_d, player_id, missing_tanks_d[player_id], app_id)
-            dmgs, spots, kills, defs, wins = account_stats_d[player_id]
-            exp_dmgs, exp_spots, exp_kills, exp_defs, exp_wins = exp_stats_d[player_id]
-
-            r_dmg = dmgs / exp_dmgs if exp_dmgs > 0 else 0
-            r_spot = spots / exp_spots if exp_spots > 0 else 0
-            r_kill = kills / exp_kills if exp_kills > 0 else 0
-            r_def = defs / exp_defs if exp_defs > 0 else 0
-            r_win = wins / exp_wins if exp_wins > 0 else 0
-
-            r_dmg_c = max(0, (r_dmg - 0.22) / 0.78)
-            r_spot_c = max(0, min(r_dmg_c + 0.1, (r_spot - 0.38) / 0.62))
-            r_kill_c = max(0, min(r_dmg_c + 0.2, (r_kill - 0.12) / 0.88))
-            r_def_c = max(0, min(r_dmg_c + 0.1, (r_def - 0.10) / 0.90))
-            r_win_c = max(0, (r_win - 0.71) / 0.29)
-
-            wn8 = 980 * r_dmg_c
-            wn8 += 210 * r_dmg_c * r_kill_c
-            wn8 += 155 * r_kill_c * r_spot_c
-            wn8 += 75 * r_def_c * r_kill_c
-            wn8 += 145 * min(1.8, r_win_c)
-            wn8_d[player_id] = wn8
+    with timing_utils.stage('wn8 math', len(player_ids)):
+        for player_id in player_ids:
+            if all(player_id in stats for stats in (account_stats_d, exp_stats_d)):
+                dmgs, spots, kills, defs, wins = account_stats_d[player_id]
+                exp_dmgs, exp_spots, exp_kills, exp_defs, exp_wins = exp_stats_d[player_id]
+
+                r_dmg = dmgs / exp_dmgs if exp_dmgs > 0 else 0
+                r_spot = spots / exp_spots if exp_spots > 0 else 0
+                r_kill = kills / exp_kills if exp_kills > 0 else 0
+                r_def = defs / exp_defs if exp_defs > 0 else 0
+                r_win = wins / exp_wins if exp_wins > 0 else 0
+
+                r_dmg_c = max(0, (r_dmg - 0.22) / 0.78)
+                r_spot_c = max(0, min(r_dmg_c + 0.1, (r_spot - 0.38) / 0.62))
+                r_kill_c = max(0, min(r_dmg_c + 0.2, (r_kill - 0.12) / 0.88))
+                r_def_c = max(0, min(r_dmg_c + 0.1, (r_def - 0.10) / 0.90))
+                r_win_c = max(0, (r_win - 0.71) / 0.29)
+
+                wn8 = 980 * r_dmg_c
+                wn8 += 210 * r_dmg_c * r_kill_c
+                wn8 += 155 * r_kill_c * r_spot_c
+                wn8 += 75 * r_def_c * r_kill_c
+                wn8 += 145 * min(1.8, r_win_c)
+                wn8_d[player_id] = wn8
 
     return wn8_d
 
 
+def calculate_recent_wn8(player_ids, exp_values_d, window_days=RECENT_WINDOW_DAYS, window_battles=None):
+    """Calculate the WN8 of a batch of players over their last days or battles, or since their oldest snapshot."""
+    wn8_d = {}
+    snapshots = snapshot_utils.list_snapshots()
+    if len(snapshots) < 2:
+        return wn8_d
+
+    account_ids = np.unique(np.array([int(player_id) for player_id in player_ids], dtype=np.int64))
+    last_timestamp, last_snapshot_file_path = snapshots[-1]
+    last_snapshot = snapshot_utils.load_snapshot(last_snapshot_file_path)
+    last_battles = snapshot_utils.get_total_battles(last_snapshot, account_ids)
+
+    # Select for each player the most recent snapshot opening the window, or else its oldest snapshot
+    reference_indexes, oldest_indexes = np.full(len(account_ids), -1), np.full(len(account_ids), -1)
+    for index in range(len(snapshots) - 2, -1, -1):
+        timestamp, snapshot_file_path = snapshots[index]
+        battles = snapshot_utils.get_total_battles(snapshot_utils.load_snapshot(snapshot_file_path), account_ids)
+        if window_battles:
+            in_window = last_battles - battles >= window_battles
+        else:
+            in_window = np.full(len(account_ids), last_timestamp - timestamp >= window_days * 24 * 3600)
+        is_snapshotted = (battles >= 0) & (last_battles >= 0)
+        reference_indexes[(reference_indexes < 0) & is_snapshotted & in_window] = index
+        oldest_indexes[is_snapshotted] = index
+    is_short_window = (reference_indexes < 0) & (oldest_indexes >= 0)
+    if is_short_window.any():
+        reference_indexes[is_short_window] = oldest_indexes[is_short_window]
+        report_short_window(window_days, window_battles, last_timestamp - snapshots[oldest_indexes[is_short_window].min()][0])
+
+    exp_tank_ids, exp_values = get_exp_values_arrays(exp_values_d)
+    for index in np.unique(reference_indexes[reference_indexes >= 0]):
+        window_account_ids = account_ids[reference_indexes == index]
+        reference_snapshot = snapshot_utils.load_snapshot(snapshots[index][1])
+        player_indexes, tank_ids, delta_stats = snapshot_utils.diff_snapshots(
+            last_snapshot, reference_snapshot, window_account_ids
+        )
+        wn8_array, battles_array = calculate_wn8_array(
+            player_indexes, tank_ids, delta_stats, len(window_account_ids), exp_tank_ids, exp_values
+        )
+        for account_id, wn8, battles in zip(window_account_ids, wn8_array, battles_array):
+            if battles > 0:
+                wn8_d[str(account_id)] = float(wn8)
+    return wn8_d
+
+
+def report_short_window(window_days, window_battles, span):
+    """Report once that recent WN8 are calculated over a shorter window than requested."""
+    window = '%d battles' % window_battles if window_battles else '%d days' % window_days
+    if (window, span) not in reported_short_windows:
+        reported_short_windows.add((window, span))
+        print("\nSnapshots do not span the recent WN8 window of {window} for all players yet, some recent WN8 are "
+              "calculated since their oldest snapshot, at most {days:.1f} days ago.".format(window=window, days=span / (24 * 3600)))
+
+
+def get_exp_values_arrays(exp_values_d):
+    """Convert the WN8 expected values to arrays sorted by tank id."""
+    if exp_values_d is exp_values_cache.get('exp_values_d'):
+        exp_tank_ids, exp_values = exp_values_cache['table']
+    else:
+        exp_tank_ids = np.array(sorted(exp_values_d), dtype=np.int64)
+        exp_values = np.array([
+            [exp_values_d[tank_id][column] for column in EXP_VALUES_COLUMNS] for tank_id in exp_tank_ids
+        ], dtype=np.float64).reshape(-1, len(EXP_VALUES_COLUMNS))
+    exp_values = exp_values * [1, 1, 1, 1, 1 / 100]  # Win ratio is a percentage
+    return exp_tank_ids, exp_values
+
+
+def calculate_wn8_array(player_indexes, tank_ids, tank_stats, player_count, exp_tank_ids, exp_values):
+    """Calculate the WN8 of players from their per-tank battles, damages, spots, kills, defs and wins."""
+    known = np.zeros(len(tank_ids), dtype=bool)
+    exp_positions = np.zeros(len(tank_ids), dtype=np.int64)
+    if len(exp_tank_ids) > 0:
+        exp_positions = np.minimum(np.searchsorted(exp_tank_ids, tank_ids), len(exp_tank_ids) - 1)
+        known = exp_tank_ids[exp_positions] == tank_ids  # Tanks without expected values are ignored
+    player_indexes, exp_positions, tank_stats = player_indexes[known], exp_positions[known], tank_stats[known]
+
+    battles = np.bincount(player_indexes, weights=tank_stats[:, 0], minlength=player_count)
+    ratios = np.zeros((player_count, 5))
+    for stat_index in range(5):
+        stats = np.bincount(player_indexes, weights=tank_stats[:, stat_index + 1], minlength=player_count)
+        exp_stats = np.bincount(player_indexes, weights=exp_values[exp_positions, stat_index] * tank_stats[:, 0], minlength=player_count)
+        np.divide(stats, exp_stats, out=ratios[:, stat_index], where=exp_stats > 0)
+    r_dmg, r_spot, r_kill, r_def, r_win = ratios.T
+
+    r_dmg_c = np.maximum(0, (r_dmg - 0.22) / 0.78)
+    r_spot_c = np.maximum(0, np.minimum(r_dmg_c + 0.1, (r_spot - 0.38) / 0.62))
+    r_kill_c = np.maximum(0, np.minimum(r_dmg_c + 0.2, (r_kill - 0.12) / 0.88))
+    r_def_c = np.maximum(0, np.minimum(r_dmg_c + 0.1, (r_def - 0.10) / 0.90))
+    r_win_c = np.maximum(0, (r_win - 0.71) / 0.29)
+
+    wn8 = 980 * r_dmg_c
+    wn8 += 210 * r_dmg_c * r_kill_c
+    wn8 += 155 * r_kill_c * r_spot_c
+    wn8 += 75 * r_def_c * r_kill_c
+    wn8 += 145 * np.minimum(1.8, r_win_c)
+    return wn8, battles
+
+
 def load_account_stats(account_stats_d, player_ids, app_id):
-    """Retrieve the required statistics of the accounts."""
+    """Retrieve the required statistics of the accounts, and tell whether the request succeeded."""
     payload = {
         'application_id': app_id,
         'account_id': ','.join(player_ids),
         'fields': ','.join(ACCOUNT_STATS_FIELD_LIST)
     }
-    response = requests.get(ACCOUNT_STATS_REQUEST_URL, params=payload)
-    response_content = response.json()
+    response_content = api_utils.request('account/info', payload)
 
     for player_id in player_ids:
         account_stats = None
@@ -129,17 +303,17 @@ def load_account_stats(account_stats_d, player_ids, app_id):
                 account_stats = dmgs, spots, kills, defs, wins
         if account_stats:
             account_stats_d[player_id] = account_stats
+    return response_content['status'] == 'ok'
 
 
 def load_expected_stats(exp_stats_d, missing_tanks_d, player_ids, exp_values_d, app_id):
-    """Calculate the required expected statistics of the accounts."""
+    """Calculate the required expected statistics of the accounts, and tell whether the request succeeded."""
     payload = {
         'application_id': app_id,
         'account_id': ','.join(player_ids),
         'fields': ','.join(ACCOUNT_TANKS_FIELD_LIST)
     }
-    response = requests.get(ACCOUNT_TANKS_REQUEST_URL, params=payload)
-    response_content = response.json()
+    response_content = api_utils.request('account/tanks', payload)
 
     for player_id in player_ids:
         exp_stats = None
@@ -162,6 +336,7 @@ def load_expected_stats(exp_stats_d, missing_tanks_d, player_ids, exp_values_d,
                 exp_stats = exp_dmgs, exp_spots, exp_kills, exp_defs, exp_wins
         if exp_stats:
             exp_stats_d[player_id] = exp_stats
+    return response_content['status'] == 'ok'
 
 
 def adjust_account_stats(account_stats_d, player_id, missing_tanks, app_id):
@@ -173,8 +348,7 @@ def adjust_account_stats(account_stats_d, player_id, missing_tanks, app_id):
             'fields': ','.join(TANK_STATS_FIELD_LIST),
             'tank_id': ','.join(missing_tanks)
         }
-        response = requests.get(TANK_STATS_REQUEST_URL, params=payload)
-        response_content = response.json()
+        response_content = api_utils.request('tanks/stats', payload)
 
         if response_content['status'] == 'ok':
             dmgs, spots, kills, defs, wins = account_stats_d[player_id]